@@ -30,7 +30,8 @@ l1, l2 = 0, 0.01
 
 model_dir = os.path.join(os.getcwd(), 'Models')
 name_model = f'{coast}_{ML}_{loss}'
-input_dir = 'Input_nc_detrend_sst' # 'Input_nc_detrend_sst'
+input_dir = '../Input_nc_all_detrend_all' # 'Input_nc_detrend_sst'
+sst_dir = 'Input_sst_data' # SST is joined from <sst_dir>/<station>_sst.nc at load time
 output_dir = 'Models'
 figures_dir = 'Figures'
 year = 'last'
@@ -48,7 +49,7 @@ print('*************************************************************************
 
 ensemble(coast, variables, ML, tt_value, input_dir, resample, resample_method, scaler,
              batch, n_layers, neurons, filters, dropout, drop_value, activation, optimizer,
-             batch_normalization, loss, epochs, loop, n_ncells, l1, l2, frac_ens, logger, verbose = 0, validation = 'select', gamma=gamma, note=note)
+             batch_normalization, loss, epochs, loop, n_ncells, l1, l2, frac_ens, logger, verbose = 0, validation = 'select', gamma=gamma, note=note, sst_dir=sst_dir)
 
 
 
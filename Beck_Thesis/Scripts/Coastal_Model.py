@@ -18,7 +18,7 @@ import numpy as np
 import random
 import keras.backend as K
 import tcn
-from station import Station
+from station import Station, BatchSequence
 
 def reset_seeds():
     #Solution to reset random states from: https://stackoverflow.com/questions/58453793/the-clear-session-method-of-keras-backend-does-not-clean-up-the-fitting-data 
@@ -228,7 +228,21 @@ class Coastal_Model():
             
             station.reload_data()
             # fit network
-            if self.validation == 'split':
+            if station.index_mode:
+                # Batches are gathered from the shared feature matrix
+                if self.validation == 'split':
+                    # Same as validation_split=0.3: the last 30% of the draws are used for validation
+                    split_at = int(len(station.train_index) * (1 - 0.3))
+                    train_index, val_index = station.train_index[:split_at], station.train_index[split_at:]
+                elif self.validation == 'select':
+                    train_index, val_index = station.train_index, station.val_index
+                else:
+                    raise ValueError('Validation must be either "split" or "select"')
+                train_data = BatchSequence(station.features, train_index, self.batch_size, self.ML, self.mask_val, shuffle=shuffle)
+                val_data = BatchSequence(station.features, val_index, self.batch_size, self.ML, self.mask_val)
+                self.history[station.name] = self.model.fit(train_data, epochs=self.epochs, validation_data=val_data,
+                                    callbacks=my_callbacks, verbose=self.verbose, shuffle=False)
+            elif self.validation == 'split':
                 self.history[station.name] = self.model.fit(station.train_X, station.train_y, epochs=self.epochs, batch_size=self.batch_size, 
                                     validation_split=0.3, callbacks=my_callbacks, verbose=self.verbose, shuffle=shuffle)
             elif self.validation == 'select':
@@ -8,45 +8,26 @@ import numpy as np
 import pandas as pd
 import to_learning
 import os
+from sst_requests import ee_array_to_df, fetch_stations, EEBackend, BAND
 
 os.chdir('..')
 
 ee.Initialize()
 
-def ee_array_to_df(arr, list_of_bands):
-    """Transforms client-side ee.Image.getRegion array to pandas.DataFrame."""
-    df = pd.DataFrame(arr)
-
-    # Rearrange the header.
-    headers = df.iloc[0]
-    df = pd.DataFrame(df.values[1:], columns=headers)
-
-    # Select desired columns
-    df = df[['longitude', 'latitude', 'time', *list_of_bands]]#.dropna()
-
-    # Convert the data to numeric values.
-    for band in list_of_bands:
-        df[band] = pd.to_numeric(df[band], errors='coerce')
-
-    # Convert the time field into a datetime.
-    df['datetime'] = pd.to_datetime(df['time'], unit='ms')
-
-    # Keep the columns of interest.
-    df = df[['longitude', 'latitude', 'datetime',  *list_of_bands]]
-
-    return df
-
 def kelvin_to_celsius(sst):
     # Convert from kelvin to celsius
     return (sst - 273.15) * 0.01
 
 
-def add_sst_to_ds(station_name, longitude, latitude):
-    """Add Sea Surface Temperate time series to a given station's netcdf file. The data is bi-daily and is upsampled to hourly with linear interpolation between values. Only the exact location is used, no spatial box. The merged ds is written as a new .nc file
+def add_sst_to_ds(station_name, longitude, latitude, input_dir='../Input_nc', output_dir='Input_nc_sst'):
+    """Add Sea Surface Temperate time series to a given station's netcdf file. The data is bi-daily and is upsampled to hourly with linear interpolation between values. Only the exact location is used, no spatial box. The station's file is copied to output_dir and only the SST data is written to the copy, the file in input_dir is left untouched.
+    Only needed for self-contained station files with SST, by default the files of get_sst_data are joined at load time (see to_learning.join_sst)
     """
     
-    # Load in original data
-    df, ds, dir = to_learning.load_file(station_name, input_dir = '../Input_nc')
+    # Load in the time axis of the original data
+    filename = os.path.join(input_dir, station_name + '.nc')
+    with xr.open_dataset(filename) as ds:
+        ds = ds[['time']].load()
 
     # Get the start and end dates of the dataset to get those same dates for the SST data
     start = np.min(np.array(ds.time))
@@ -70,37 +51,52 @@ def add_sst_to_ds(station_name, longitude, latitude):
             .resample('H').mean().interpolate() # Resample hourly and interpolate between values
             .to_xarray())
     
-    print('Merging')
-    
-    sst_ds = xr.merge([ds, sst_ds]) # Merge datasets
-    
     print('Writing')
-    sst_ds.to_netcdf('Input_nc_sst/' + station_name + '.nc') # Write to a new file
+    to_learning.append_sst(filename, sst_ds['sst'], os.path.join(output_dir, station_name + '.nc')) # Add to a copy of the station's file
 
 
-def get_sst_data(station):
+def sst_to_ds(sst_df):
+    """Convert the SST retrieved for a station to celsius and upsample it to an hourly dataset
 
-    station_sst = (sst.filter(ee.Filter.date(station['start_date'], station['end_date']))
-                .getRegion(ee.Geometry.Point(station['Lon'], station['Lat']), 30)
-                .getInfo())
-    
-    # Convert to a pandas dataframe and convert to celsius
-    sst_df = ee_array_to_df(station_sst, ['sea_surface_temperature'])
-    
-    if sst_df['sea_surface_temperature'].count() == 0:
-        print(f'No data for {station["Station"]}')
-        return
-    
-    sst_df['sst'] =  kelvin_to_celsius(sst_df['sea_surface_temperature'])
+    Args:
+        sst_df (pd.DataFrame): 'datetime' and the SST band as returned by the Earth Engine
+
+    Returns:
+        xr.Dataset: Hourly 'sst' in celsius, linearly interpolated between values
+    """
+    sst_df = sst_df.copy()
+    sst_df['sst'] =  kelvin_to_celsius(sst_df[BAND])
     sst_df = sst_df[['datetime', 'sst']]
         
     sst_df['time'] = pd.to_datetime(sst_df['datetime'])
-    sst_ds = (sst_df.set_index('time')
+    return (sst_df.set_index('time')[['sst']]
             .resample('H').mean().interpolate() # Resample hourly and interpolate between values
             .to_xarray())
-    
-    print('Writing')
-    sst_ds.to_netcdf('Input_sst_data/' + station['Station'] + '_sst.nc') # Write to a new file
+
+
+def get_sst_data(stations, backend=None, output_dir='Input_sst_data', workers=8):
+    """Get the SST of all stations and write it to <output_dir>/<station>_sst.nc.
+
+    The requests of all stations are sent concurrently in yearly chunks, and every chunk is cached,
+    so a re-run only fetches what is missing. Stations that already have an output file are skipped.
+
+    Args:
+        stations (pd.DataFrame): 'Station', 'Lon', 'Lat', 'start_date' and 'end_date' per station
+        backend (optional): Object with a get_region(longitude, latitude, start, end) method. Defaults to EEBackend().
+        output_dir (str, optional): Directory of the SST files. Defaults to 'Input_sst_data'.
+        workers (int, optional): Number of requests running at the same time. Defaults to 8.
+    """
+    backend = EEBackend() if backend is None else backend
+    todo = stations[[not os.path.exists(os.path.join(output_dir, name + '_sst.nc'))
+                     for name in stations['Station']]]
+    print(f'Getting SST for {len(todo)} of {len(stations)} stations\n')
+
+    for name, sst_df in fetch_stations(todo, backend, workers=workers).items():
+        if sst_df[BAND].count() == 0:
+            print(f'No data for {name}')
+            continue
+        print(f'Writing {name}')
+        sst_to_ds(sst_df).to_netcdf(os.path.join(output_dir, name + '_sst.nc')) # Write to a new file
 
 sst = (ee.ImageCollection('NOAA/CDR/SST_PATHFINDER/V53')
             .select('sea_surface_temperature'))
@@ -117,11 +113,7 @@ stations2['start_date'] = pd.to_datetime(stations2['start_date'])
 stations2['end_date'] = pd.to_datetime(stations2['end_date'])
 # stations2 = stations2[stations2['Coast'] == 'NE_Atlantic_Yellow']
 
-for index, station in stations2.iterrows():
-    print(f'\nGetting SST for Station: {station["Station"]}')
-    # if index == 0:
-    #     stat = station
-    get_sst_data(station)
+get_sst_data(stations2)
 
 
 # REMOVE STATIONS WITHOUT DATA
@@ -24,6 +24,7 @@ import tcn
 os.chdir('/Users/beck/My Drive/VU/Thesis/Scripts/Beck_Thesis/')
 
 import to_learning
+import station_catalog
 import performance
 import model_run_coast as mr
 import Coastal_Model as cm
@@ -664,7 +665,8 @@ plt.show()
 coast = 'NE_Atlantic_Yellow'
 ML = 'LSTM'
 stations = {}
-for station in reversed(mr.get_coast_stations(coast)[0:2]):
+catalog = station_catalog.build_catalog(input_dir)
+for station in reversed(to_learning.get_coast_stations(coast, catalog)[0][0:2]):
     # Get input data for the station
     # This includes the train, test, and validation data, as well as the scaler and transformed data for inverse transforming
     stations[station] = mr.get_input_data(station, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger)
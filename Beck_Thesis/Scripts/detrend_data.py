@@ -1,104 +1,151 @@
-
+import numpy as np
+import os
 import xarray as xr
 import pandas as pd
-import matplotlib.pyplot as plt
+from multiprocessing import Pool
+
+def annual_detrend(ds: xr.Dataset) -> xr.Dataset:
+    """Subtract the annual mean from every variable at every grid cell.
+
+    The annual means are computed per calendar year with groupby('time.year') and broadcast
+    back along time, so every hour in a given year has the mean of that year subtracted.
+    Missing values in the original data stay missing.
+
+    Args:
+        ds (xr.Dataset): Dataset with a time dimension
+
+    Returns:
+        xr.Dataset: Detrended dataset with the same dimensions as the input
+    """
+    annual_mean = ds.groupby('time.year').mean('time')
+    return (ds.groupby('time.year') - annual_mean).drop_vars('year')
+
+
+def linear_detrend(ds: xr.Dataset) -> xr.Dataset:
+    """Subtract a least squares linear trend (and the mean) from every variable at every grid cell.
+
+    The slope is computed in closed form over the time dimension, ignoring missing values.
+
+    Args:
+        ds (xr.Dataset): Dataset with a time dimension
+
+    Returns:
+        xr.Dataset: Detrended dataset with the same dimensions as the input
+    """
+    t = (ds['time'] - ds['time'][0]) / np.timedelta64(1, 'D')
+
+    def detrend_var(da):
+        t_valid = t.where(da.notnull())
+        t_anom = t_valid - t_valid.mean('time')
+        da_anom = da - da.mean('time')
+        slope = (t_anom * da_anom).sum('time') / (t_anom ** 2).sum('time')
+        return da_anom - slope * (t - t_valid.mean('time'))
+
+    return ds.map(detrend_var)
+
+
+def rolling_detrend(ds: xr.Dataset, window: int = 365 * 24) -> xr.Dataset:
+    """Subtract a centred rolling mean of window timesteps from every variable at every grid cell.
+
+    The rolling mean is computed from cumulative sums along time, ignoring missing values,
+    so the cost does not grow with the window length.
+
+    Args:
+        ds (xr.Dataset): Dataset with a time dimension
+        window (int): Number of timesteps in the rolling window
+
+    Returns:
+        xr.Dataset: Detrended dataset with the same dimensions as the input
+    """
+    n = len(ds['time'])
+    start = np.clip(np.arange(n) - window // 2, 0, n)
+    end = np.clip(np.arange(n) + window - window // 2, 0, n)
+
+    def detrend_var(da):
+        da = da.transpose('time', ...)
+        values = da.values
+        valid = ~np.isnan(values)
+        zero = np.zeros((1,) + values.shape[1:])
+        csum = np.concatenate([zero, np.cumsum(np.where(valid, values, 0), axis=0)])
+        ccount = np.concatenate([zero, np.cumsum(valid, axis=0)])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rolling_mean = (csum[end] - csum[start]) / (ccount[end] - ccount[start])
+        return da.copy(data=values - rolling_mean)
+
+    return ds.map(detrend_var)
+
+
+DETREND_METHODS = {'annual': annual_detrend,
+                   'linear': linear_detrend,
+                   'rolling': rolling_detrend}
 
-def detrend_data(station: str):
-    """Annually detrend all variables in the dataset. 
+
+def detrend(ds: xr.Dataset, method: str = 'annual', **kwargs) -> xr.Dataset:
+    """Detrend all variables in the dataset with one of the DETREND_METHODS ('annual', 'linear', 'rolling').
+    """
+    if method not in DETREND_METHODS:
+        raise ValueError(f'Detrending method must be one of {list(DETREND_METHODS)}')
+    return DETREND_METHODS[method](ds, **kwargs)
+
+
+def detrend_data(station: str, method: str = 'annual', input_dir: str = '../Input_nc_sst',
+                 output_dir: str = '../Input_nc_sst_detrend'):
+    """Detrend all variables in the dataset.
 
     Args:
         station (str): Name of station
+        method (str): Detrending method, see DETREND_METHODS
+        input_dir (str): Directory of the input files
+        output_dir (str): Directory of the detrended files
     """
     # Load in file
-    ds = xr.open_dataset('../Input_nc_sst/' + station + '.nc')
-    df = (ds.to_dataframe()
-          .drop(['uquad', 'vquad'], axis=1)) # Remove quadratic terms before detrending
-    
-    df_levels = df.index.get_level_values
-    start_date = df_levels('time')[0]
-    end_date = df_levels('time')[-1]
-
-    # Calculate the annual mean for each year, and unique pairing of latitude and longitude
-    df_annual_mean = df.groupby([pd.Grouper(level='time', freq='A'),
-                                        pd.Grouper(level='latitude'), 
-                                        pd.Grouper(level='longitude') 
-                                ]
-          ).mean()
-    
-    cols = df_annual_mean.columns.tolist() 
-    df_annual_levels = df_annual_mean.index.get_level_values
-    
-    # Create a dataframe of unique latitudes and longitudes
-    unique_loc = pd.DataFrame([df_annual_levels('latitude'),df_annual_levels('longitude')], index = ['latitude', 'longitude']).T.drop_duplicates()
-
-    def get_helper_df(vals, date, cols, unique_loc):
-        """Creates a helper dataframe with place holder values to augment resampled data. Has the same columns as the original df, and has placeholders for a single date and for each unique location.
-
-        Args:
-            vals (_type_): row value place holders
-            date (_type_): date to assign
-            cols (_type_): columns of the original dataframe
-            unique_loc (_type_): unique locations
-        """
-        temp = pd.DataFrame([vals for x in range(unique_loc.shape[0])], 
-                            columns = cols)
-        temp['time'] = pd.to_datetime(date)
-        return pd.concat([unique_loc, temp], axis=1)
-    
-    # Create helper dataframe with place holder values for one year before the start date and one year after the end date
-    # This is to ensure when interpolating with backfill
-    # that the entire date range in the original dataframe is covered. 
-    # We have to do this because resampling to get the annual mean puts the date at the end of the year
-    # So we lose the whole year before the last date when resampling back to hourly.
-    # We have to add the extra year at the end because of the backfill interpolation.
-    # We assign this extra year to be the last values in the averaged dataframe.
-    start = get_helper_df(vals = [0] * len(cols), 
-                          date = start_date - pd.DateOffset(years=1), 
-                          cols = cols, unique_loc=unique_loc)
-    
-    end = get_helper_df(vals = df_annual_mean.iloc[-1,:].to_list(), 
-                        date = end_date + pd.DateOffset(years=1), 
-                        cols = cols, unique_loc=unique_loc)
-    
-    # Add the start and end helper dataframes to the original dataframe and reset the indices
-    df_avg_helper = pd.concat([start, df_annual_mean.reset_index(), end]).set_index('time').sort_index()
-    
-    # Loop through each unique location, resample the average dataframe hourly
-    # Then interpolate with backfill so for every hour in a given year, it has the mean of the year
-    # Join all of these dataframes together
-    for index, row in unique_loc.iterrows():
-        print(f'{index=} | lat: {row["latitude"]} | lon: {row["longitude"]}\n')
-        df_avg_loc = (df_avg_helper[(df_avg_helper['latitude'] == row['latitude']) & 
-                                    (df_avg_helper['longitude'] == row['longitude'])]
-                      .resample('H').interpolate(method='bfill', limit_direction = 'backward')
-                      .loc[start_date:end_date]) # Only keep the date ranges in the original dataframe
-        if index == 0:
-            df_avg = df_avg_loc
-        else:
-            df_avg = pd.concat([df_avg, df_avg_loc]).sort_index()
-    
-    df_avg = df_avg.reset_index().set_index(['time', 'latitude', 'longitude']).sort_index() # Reset multiindex
-    
-    # Detrend data by subtracting the annual mean of each variable from the original dataframe
-    df_full = pd.DataFrame()
-    for col in cols:
-        # Here all of the missing data in the original dataframe will override the interpolated averages values
-        # So the result in the detrended dataset will still be a missing value
-        df_full[col] = df[col] - df_avg[col]
+    ds = xr.open_dataset(os.path.join(input_dir, station + '.nc'))
+    ds = ds.drop_vars(['uquad', 'vquad']) # Remove quadratic terms before detrending
+
+    ds_detrend = detrend(ds, method)
 
     # Calculate quadratic terms on detrended data
-    df_full['uquad'] = df_full['u10'] ** 2
-    df_full['vquad'] = df_full['v10'] ** 2
-    
+    ds_detrend['uquad'] = ds_detrend['u10'] ** 2
+    ds_detrend['vquad'] = ds_detrend['v10'] ** 2
+
     # Save to netcdf
-    df_full.to_xarray().to_netcdf('../Input_nc_sst_detrend/' + station + '.nc')
+    ds_detrend.to_netcdf(os.path.join(output_dir, station + '.nc'))
+    ds.close()
+
+
+def is_up_to_date(station: str, input_dir: str, output_dir: str) -> bool:
+    """Whether the detrended output of a station exists and is newer than its input
+    """
+    input_file = os.path.join(input_dir, station + '.nc')
+    output_file = os.path.join(output_dir, station + '.nc')
+    return os.path.exists(output_file) and os.path.getmtime(output_file) > os.path.getmtime(input_file)
+
+
+def detrend_stations(stations: list, method: str = 'annual', input_dir: str = '../Input_nc_sst',
+                     output_dir: str = '../Input_nc_sst_detrend', workers: int = os.cpu_count(),
+                     overwrite: bool = False):
+    """Detrend a list of stations in parallel. Stations whose output is newer than their input are skipped.
+
+    Args:
+        stations (list): Names of stations
+        method (str): Detrending method, see DETREND_METHODS
+        input_dir (str): Directory of the input files
+        output_dir (str): Directory of the detrended files
+        workers (int): Number of worker processes
+        overwrite (bool): Detrend all stations, even if their output is up to date
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    todo = [station for station in stations
+            if overwrite or not is_up_to_date(station, input_dir, output_dir)]
+    print(f'Detrending {len(todo)} of {len(stations)} stations with {method} detrending\n')
+
+    with Pool(workers) as p:
+        p.starmap(detrend_data, [(station, method, input_dir, output_dir) for station in todo])
 
 
-# # Load in list of selected stations
-# # We drop the stations that do not have data 
-stations = pd.read_csv('../Coast_orientation/Selected_Stations_dates.csv').dropna()
+if __name__ == '__main__':
+    # # Load in list of selected stations
+    # # We drop the stations that do not have data
+    stations = pd.read_csv('../Coast_orientation/Selected_Stations_dates.csv').dropna()
 
-for index, station in stations.iterrows():
-    print(f'Detrending Data for Station: {station["Station"]}\n')
-    
-    detrend_data(station['Station'])
+    detrend_stations(stations['Station'].tolist())
@@ -0,0 +1,120 @@
+'''
+Store of prepared station inputs.
+
+The output of to_learning.prepare_station is stored as .npy arrays that are memory-mapped when loaded,
+so a station only has to be prepared once for all ML types and coast runs.
+Entries are named after a hash of the preparation settings, the input files (size and modification time)
+and FEATURE_VERSION, which has to be increased whenever the preparation itself changes.
+'''
+import hashlib
+import json
+import os
+import shutil
+
+import joblib
+import numpy as np
+import pandas as pd
+
+FEATURE_DIR = 'Feature_store'
+# 1: initial layout
+# 2: test window from test_window_ends, positional test split, chunked scaler fitting,
+#    gridded residual/sst taken from the first grid cell
+FEATURE_VERSION = 2
+
+
+def feature_key(source, **settings):
+    """Hash of the preparation settings and the input files of a station.
+
+    Args:
+        source (str or list): Path of the station's input file, or paths of all its input files (e.g. with the SST file)
+        **settings: Preparation settings, e.g. station, variables, n_ncells, resample, scaler_type, year
+
+    Returns:
+        str: Key of the feature store entry
+    """
+    sources = [source] if isinstance(source, str) else source
+    files = [[os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in sources]
+    key = {'version': FEATURE_VERSION, 'sources': files, **settings}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def save_features(key, df, lat_list, lon_list, direction, step, reframed=None, scaler=None, dates=None, i_dates=None,
+                  feature_dir=FEATURE_DIR):
+    """Store prepared station input. The scaled part (reframed, scaler, dates and i_dates) is optional.
+
+    The entry is written to a temporary directory first and then moved in place. When another process
+    stored the same entry in the meantime, that entry is kept.
+
+    Args:
+        key (str): Key of the entry, see feature_key
+        df (pd.DataFrame): Prepared input data with a time index
+        lat_list (np.array): Latitudes of the spatial box
+        lon_list (np.array): Longitudes of the spatial box
+        direction (str): Coast orientation of the station
+        step (int): Number of timesteps per day
+        reframed (pd.DataFrame, optional): Scaled and reframed data. Defaults to None.
+        scaler (optional): Fitted scaler. Defaults to None.
+        dates (np.array, optional): Dates of the test year. Defaults to None.
+        i_dates (np.array, optional): Positions of the test year. Defaults to None.
+        feature_dir (str, optional): Directory of the feature store. Defaults to FEATURE_DIR.
+    """
+    path = os.path.join(feature_dir, key)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, 'df.npy'), np.ascontiguousarray(df.values))
+    np.save(os.path.join(tmp_path, 'time.npy'), df.index.values)
+    np.save(os.path.join(tmp_path, 'lat_list.npy'), lat_list)
+    np.save(os.path.join(tmp_path, 'lon_list.npy'), lon_list)
+    meta = {'columns': df.columns.tolist(), 'index_name': df.index.name, 'direction': direction, 'step': step}
+
+    if reframed is not None:
+        np.save(os.path.join(tmp_path, 'reframed.npy'), np.ascontiguousarray(reframed.values))
+        np.save(os.path.join(tmp_path, 'dates.npy'), dates)
+        np.save(os.path.join(tmp_path, 'i_dates.npy'), i_dates)
+        joblib.dump(scaler, os.path.join(tmp_path, 'scaler.joblib'))
+        meta['reframed_columns'] = reframed.columns.tolist()
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path)
+
+
+def load_features(key, feature_dir=FEATURE_DIR):
+    """Load a stored entry with its arrays memory-mapped copy-on-write, so changes stay in memory.
+
+    Args:
+        key (str): Key of the entry, see feature_key
+        feature_dir (str, optional): Directory of the feature store. Defaults to FEATURE_DIR.
+
+    Returns:
+        dict: df, lat_list, lon_list, direction, step and, when stored, reframed, scaler, dates and i_dates.
+            None when there is no entry.
+    """
+    path = os.path.join(feature_dir, key)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+
+    index = pd.Index(np.load(os.path.join(path, 'time.npy')), name=meta['index_name'])
+    features = {'df': pd.DataFrame(np.load(os.path.join(path, 'df.npy'), mmap_mode='c'), index=index,
+                                   columns=meta['columns'], copy=False),
+                'lat_list': np.load(os.path.join(path, 'lat_list.npy')),
+                'lon_list': np.load(os.path.join(path, 'lon_list.npy')),
+                'direction': meta['direction'],
+                'step': meta['step']}
+
+    if 'reframed_columns' in meta:
+        features['reframed'] = pd.DataFrame(np.load(os.path.join(path, 'reframed.npy'), mmap_mode='c'),
+                                            columns=meta['reframed_columns'], copy=False)
+        features['dates'] = np.load(os.path.join(path, 'dates.npy'))
+        features['i_dates'] = np.load(os.path.join(path, 'i_dates.npy'))
+        features['scaler'] = joblib.load(os.path.join(path, 'scaler.joblib'))
+    return features
@@ -1,26 +1,29 @@
 import numpy as np
 import pandas as pd
-import to_learning
+import station_catalog
 import os
 
 # os.chdir('..')
 
-def get_date_range(station):
+def get_date_range(station, catalog):
     print(f'Getting Dates for Station: {station["Station"]}\n')
     
-    df, ds, dir = to_learning.load_file(station['Station'], input_dir = 'Input_nc')
     # Get the start and end dates of the dataset to get those same dates for the SST data
-    start = np.min(np.array(ds.time))
-    start = pd.to_datetime(str(start)).strftime('%Y-%m-%d')
+    entry = catalog.loc[station['Station']]
+    start = entry['start'].strftime('%Y-%m-%d')
     
-    end = np.max(np.array(ds.time)) + pd.DateOffset(1) # Add one day after end because filtering is exclusive
-    end = pd.to_datetime(str(end)).strftime('%Y-%m-%d')
+    end = entry['end'] + pd.DateOffset(1) # Add one day after end because filtering is exclusive
+    end = end.strftime('%Y-%m-%d')
     
     return start, end
 
-stations = pd.read_csv('Coast_orientation/Selected_Stations.csv')
-# stations = stations[stations['Coast'] == 'NE_Atlantic_Yellow']
+if __name__ == '__main__':
+    # Only the metadata and residuals of the station files are read, and unchanged files are not read again
+    catalog = station_catalog.build_catalog('Input_nc')
 
-stations['start_date'], stations['end_date'] = zip(*stations.apply(get_date_range, axis=1))
+    stations = pd.read_csv('Coast_orientation/Selected_Stations.csv')
+    # stations = stations[stations['Coast'] == 'NE_Atlantic_Yellow']
 
-stations.to_csv('Coast_orientation/Selected_Stations_dates.csv')
\ No newline at end of file
+    stations['start_date'], stations['end_date'] = zip(*stations.apply(get_date_range, axis=1, catalog=catalog))
+
+    stations.to_csv('Coast_orientation/Selected_Stations_dates.csv')
@@ -5,25 +5,33 @@ import os
 
 os.chdir('..')
 
-def merge_sst_ds(station):
+def merge_sst_ds(station, input_dir='../Input_nc_all_detrend_all', output_dir='Input_nc_detrend_sst', sst_dir='Input_sst_data'):
+    """Add the SST series of a station as a variable to a copy of its (detrended) gridded netcdf file in output_dir.
+    Only needed for self-contained station files with SST: by default the SST stays in sst_dir and is joined at load time
+    (sst_dir of model_run_coast.ensemble, see to_learning.join_sst), so the gridded file is never copied.
+    """
+    sst = xr.open_dataset(os.path.join(sst_dir, station + '_sst.nc'))['sst']
 
-    df, ds, dir = to_learning.load_file(station, input_dir = '../Input_nc_all_detrend_all')
-    
-    sst_ds = xr.open_dataset('Input_sst_data/' + station + '_sst.nc')
-    
-    sst_ds = xr.merge([ds, sst_ds]) # Merge datasets
-        
     print('Writing')
-    sst_ds.to_netcdf('Input_nc_detrend_sst/' + station + '.nc') # Write to a new file
+    to_learning.append_sst(os.path.join(input_dir, station + '.nc'), sst, os.path.join(output_dir, station + '.nc'))
+
 
+def has_sst(station, output_dir='Input_nc_detrend_sst'):
+    filename = os.path.join(output_dir, station + '.nc')
+    if not os.path.exists(filename):
+        return False
+    with xr.open_dataset(filename) as ds:
+        return 'sst' in ds
 
-stations = pd.read_csv('Coast_orientation/Selected_Stations_dates.csv').dropna().reset_index(drop=True)
 
-for index, station in stations.iterrows():
-    print(f'Merging SST for Station {index}: {station["Station"]}\n')
-    
-    if os.path.exists('Input_nc_detrend_sst/' + station['Station'] + '.nc'):
-        print('File already exists')
-        continue
-    else:
-        merge_sst_ds(station['Station'])
\ No newline at end of file
+if __name__ == '__main__':
+    stations = pd.read_csv('Coast_orientation/Selected_Stations_dates.csv').dropna().reset_index(drop=True)
+
+    for index, station in stations.iterrows():
+        print(f'Merging SST for Station {index}: {station["Station"]}\n')
+        
+        if has_sst(station['Station']):
+            print('SST already added')
+            continue
+        else:
+            merge_sst_ds(station['Station'])
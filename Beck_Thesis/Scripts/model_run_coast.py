@@ -15,7 +15,7 @@ import random as rand
 import sys
 sys.path.append(os.path.join(sys.path[0], r'./Scripts/'))
 
-from Scripts import to_learning, performance
+from Scripts import to_learning, performance, station_catalog
 from Scripts.Coastal_Model import Coastal_Model
 from Scripts.station import Station
 
@@ -72,7 +72,8 @@ def set_logger(arg_start, arg_end, verbose=True):
 def ensemble(coast, variables, ML, tt_value, input_dir, resample, resample_method, scaler_type,
              batch, n_layers, neurons, filters, dropout, drop_value, activation, optimizer,
              batch_normalization, loss, epochs, loop=5, n_ncells=2, l1=0.00, l2=0.01, frac_ens=0.5, logger=False, complexity=False,
-             year='last', fn_exp='Models', arg_count=0, verbose=2, mask_val=-999, hyper_opt=False, NaN_threshold=0, validation='split', gamma=1.1, note=''):
+             year='last', fn_exp='Models', arg_count=0, verbose=2, mask_val=-999, hyper_opt=False, NaN_threshold=0, validation='split', gamma=1.1, note='',
+             feature_dir='Feature_store', sst_dir='Input_sst_data'):
 
     start1 = time.time()
 
@@ -87,6 +88,9 @@ def ensemble(coast, variables, ML, tt_value, input_dir, resample, resample_metho
     
     if resample == 'hourly':                            
         batch = batch * 24
+
+    # Station catalog of the input files, used to screen the coast stations without loading them
+    catalog = station_catalog.build_catalog(input_dir)
     
     for ML in ML_list: # Loop over each type of ML model
         
@@ -105,7 +109,7 @@ def ensemble(coast, variables, ML, tt_value, input_dir, resample, resample_metho
 
         
         # Get input data for each station
-        stations = to_learning.get_all_station_data(coast, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir)
+        stations = to_learning.get_all_station_data(coast, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir, feature_dir, sst_dir, catalog)
                                         
             
         for i in range(loop): # Loop is number of models in the ensemble
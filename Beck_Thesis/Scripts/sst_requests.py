@@ -0,0 +1,181 @@
+'''
+Retrieval of Sea Surface Temperature point time series from Google Earth Engine.
+
+Long date ranges are split into calendar-aligned chunks that stay under the per-request limits of getRegion.
+Every chunk is cached as the raw getRegion response in a file named after a hash of the request,
+so a re-run only fetches the chunks that are missing. Chunks of all stations are fetched concurrently
+by a bounded number of threads. Any object with a get_region(longitude, latitude, start, end) method
+can serve the requests, e.g. LocalBackend for testing without Earth Engine.
+'''
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+COLLECTION = 'NOAA/CDR/SST_PATHFINDER/V53'
+BAND = 'sea_surface_temperature'
+SCALE = 30
+CACHE_DIR = 'SST_cache'
+
+
+def ee_array_to_df(arr, list_of_bands):
+    """Transforms client-side ee.Image.getRegion array to pandas.DataFrame."""
+    df = pd.DataFrame(arr)
+
+    # Rearrange the header.
+    headers = df.iloc[0]
+    df = pd.DataFrame(df.values[1:], columns=headers)
+
+    # Select desired columns
+    df = df[['longitude', 'latitude', 'time', *list_of_bands]]#.dropna()
+
+    # Convert the data to numeric values.
+    for band in list_of_bands:
+        df[band] = pd.to_numeric(df[band], errors='coerce')
+
+    # Convert the time field into a datetime.
+    df['datetime'] = pd.to_datetime(df['time'], unit='ms')
+
+    # Keep the columns of interest.
+    df = df[['longitude', 'latitude', 'datetime',  *list_of_bands]]
+
+    return df
+
+
+def date_chunks(start, end, freq='Y'):
+    """Split a date range into calendar-aligned chunks.
+
+    The chunks cover whole periods (e.g. whole years), so the same chunks are requested
+    whatever the exact start and end dates are, and they can be shared between runs.
+
+    Args:
+        start (str or pd.Timestamp): First date of the range
+        end (str or pd.Timestamp): Date after the last date of the range (exclusive)
+        freq (str, optional): Pandas period frequency of the chunks. Defaults to 'Y' (yearly).
+
+    Returns:
+        list: (start, end) date strings per chunk, end exclusive
+    """
+    periods = pd.period_range(pd.Timestamp(start), pd.Timestamp(end) - pd.Timedelta(1, 'ns'), freq=freq)
+    return [(p.start_time.strftime('%Y-%m-%d'), (p + 1).start_time.strftime('%Y-%m-%d')) for p in periods]
+
+
+def request_key(longitude, latitude, start, end, collection=COLLECTION, scale=SCALE):
+    request = [collection, BAND, scale, round(float(longitude), 6), round(float(latitude), 6), start, end]
+    return hashlib.sha1(json.dumps(request).encode()).hexdigest()
+
+
+def fetch_chunk(backend, longitude, latitude, start, end, cache_dir=CACHE_DIR, retries=3):
+    """Return the getRegion response of one chunk from the cache, requesting it with backend if it is missing.
+
+    Args:
+        backend: Object with a get_region(longitude, latitude, start, end) method, e.g. EEBackend()
+        longitude (float): Longitude of the point
+        latitude (float): Latitude of the point
+        start (str): First date of the chunk
+        end (str): Date after the last date of the chunk (exclusive)
+        cache_dir (str, optional): Directory of the cached responses. Defaults to CACHE_DIR.
+        retries (int, optional): Number of retries after a failed request. Defaults to 3.
+
+    Returns:
+        list: getRegion array, with the header as first row
+    """
+    cache_file = os.path.join(cache_dir, request_key(longitude, latitude, start, end) + '.json')
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+
+    for attempt in range(retries + 1):
+        try:
+            arr = backend.get_region(longitude, latitude, start, end)
+            break
+        except Exception:
+            if attempt == retries:
+                raise
+
+    tmp_file = cache_file + '.part'
+    with open(tmp_file, 'w') as f:
+        json.dump(arr, f)
+    os.replace(tmp_file, cache_file)
+    return arr
+
+
+def fetch_stations(stations, backend, cache_dir=CACHE_DIR, workers=8, freq='Y', retries=3):
+    """Fetch the SST of all stations, with all missing chunks requested concurrently.
+
+    Args:
+        stations (pd.DataFrame): 'Station', 'Lon', 'Lat', 'start_date' and 'end_date' (exclusive) per station
+        backend: Object with a get_region(longitude, latitude, start, end) method, e.g. EEBackend()
+        cache_dir (str, optional): Directory of the cached responses. Defaults to CACHE_DIR.
+        workers (int, optional): Number of requests running at the same time. Defaults to 8.
+        freq (str, optional): Pandas period frequency of the chunks. Defaults to 'Y' (yearly).
+        retries (int, optional): Number of retries after a failed request. Defaults to 3.
+
+    Returns:
+        dict: Station name -> pd.DataFrame with 'datetime' and the SST band within the station's date range,
+            for every station whose chunks were all retrieved
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    chunks = {station['Station']: date_chunks(station['start_date'], station['end_date'], freq)
+              for _, station in stations.iterrows()}
+    stations = stations.set_index('Station')
+
+    responses = {}
+    failed = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_chunk, backend, stations.loc[name, 'Lon'], stations.loc[name, 'Lat'],
+                                   start, end, cache_dir, retries): (name, start)
+                   for name, station_chunks in chunks.items() for start, end in station_chunks}
+        for future in as_completed(futures):
+            name, start = futures[future]
+            try:
+                responses[name, start] = future.result()
+            except Exception as e:
+                print(f'Failed to get SST for {name} from {start}: {e!r}')
+                failed.add(name)
+
+    sst = {}
+    for name, station_chunks in chunks.items():
+        if name in failed:
+            continue
+        df = pd.concat([ee_array_to_df(responses[name, start], [BAND]) for start, _ in station_chunks],
+                       ignore_index=True)
+        in_range = ((df['datetime'] >= pd.Timestamp(stations.loc[name, 'start_date'])) &
+                    (df['datetime'] < pd.Timestamp(stations.loc[name, 'end_date'])))
+        sst[name] = df[in_range].reset_index(drop=True)
+    return sst
+
+
+class EEBackend():
+    """Serves requests from the Earth Engine image collection. ee must be initialized before use."""
+    def __init__(self, collection=COLLECTION, scale=SCALE):
+        import ee
+        self.ee = ee
+        self.collection = ee.ImageCollection(collection).select(BAND)
+        self.scale = scale
+
+    def get_region(self, longitude, latitude, start, end):
+        return (self.collection.filter(self.ee.Filter.date(start, end))
+                .getRegion(self.ee.Geometry.Point(float(longitude), float(latitude)), self.scale)
+                .getInfo())
+
+
+class LocalBackend():
+    """Stand-in for Earth Engine that serves canned getRegion responses from a local directory.
+
+    A request is served from <source_dir>/<request key>.json; every served request is kept in self.requests.
+    """
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+        self.requests = []
+
+    def get_region(self, longitude, latitude, start, end):
+        self.requests.append((longitude, latitude, start, end))
+        key = request_key(longitude, latitude, start, end)
+        source = os.path.join(self.source_dir, key + '.json')
+        if not os.path.exists(source):
+            raise FileNotFoundError(f'No local response for request {key}')
+        with open(source) as f:
+            return json.load(f)
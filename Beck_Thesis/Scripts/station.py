@@ -7,9 +7,47 @@ import os
 import keras
 import sys
 
+class BatchSequence(keras.utils.Sequence):
+    """Batches of rows of a shared feature matrix, gathered on the fly from an index array.
+    The last column of the matrix is the target. Missing values are masked like in to_learning.select_ensemble.
+    """
+    def __init__(self, features, index, batch_size, ML, mask_val=-999, shuffle=False):
+        self.features = features
+        self.index = np.array(index)
+        self.batch_size = batch_size
+        self.ML = ML
+        self.mask_val = mask_val
+        self.shuffle = shuffle
+        if self.shuffle:
+            np.random.shuffle(self.index)
+    
+    def __len__(self):
+        return int(np.ceil(len(self.index) / self.batch_size))
+    
+    def __getitem__(self, i):
+        # Fancy indexing returns a copy, so the shared matrix is never modified
+        batch = self.features[self.index[i * self.batch_size:(i + 1) * self.batch_size]]
+        batch[np.isnan(batch)] = self.mask_val
+        batch[batch[:, -1] == self.mask_val] = self.mask_val
+        X, y = batch[:, :-1], batch[:, -1]
+        if self.ML in ['LSTM', 'TCN', 'TCN-LSTM']:
+            # reshape input to be 3D [samples, timesteps, features]
+            X = X.reshape((X.shape[0], 1, X.shape[1]))
+        return X, y
+    
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.index)
+
+
 class Station():
     
-    def __init__(self, station_name, train_test, train_X, train_Y, test_X, test_Y, val_X, val_Y, scaler, df, reframed_df, n_train_final, test_dates, test_year, model_dir, ML):
+    def __init__(self, station_name, train_test, train_X, train_Y, test_X, test_Y, val_X, val_Y, scaler, df, reframed_df, n_train_final, test_dates, test_year, model_dir, ML,
+                 features=None, train_index=None, val_index=None):
+        """If features is given, the training and validation data are the rows train_index and val_index of the features
+        matrix (with the target as last column), and are gathered in batches during training with BatchSequence.
+        The test set is then the rows test_dates of the matrix, so only the matrix and the index arrays are stored.
+        """
         self.train_X = train_X
         self.name = station_name
         self.train_y = train_Y
@@ -24,6 +62,11 @@ class Station():
         self.test_dates = test_dates
         self.test_year = test_year
         self.train_test = train_test
+        self.ML = ML
+        self.index_mode = features is not None
+        self.features = features
+        self.train_index = train_index
+        self.val_index = val_index
         
         
         
@@ -47,6 +90,20 @@ class Station():
         self.store_and_delete_data(store=True)
     
     def store_and_delete_data(self, store=False):
+        if self.index_mode:
+            if store:
+                np.save(f'{self.data_path}/features.npy', self.features)
+                np.savez(f'{self.data_path}/index.npz', train_index=self.train_index, val_index=self.val_index)
+            
+            # Delete unneeded variables, the test set is derived from the features again in reload_data
+            del self.features
+            del self.train_index
+            del self.val_index
+            del self.test_X
+            del self.test_y
+            del self.test_year
+            return
+        
         if store:
             with open(f'{self.data_path}/data.npy', 'wb') as f:
                 np.save(f, self.train_X)
@@ -86,6 +143,22 @@ class Station():
         del self.test_year
     
     def reload_data(self):
+        if self.index_mode:
+            # The feature matrix is shared read-only, batches are gathered from it with BatchSequence
+            self.features = np.load(f'{self.data_path}/features.npy', mmap_mode='r')
+            with np.load(f'{self.data_path}/index.npz') as index:
+                self.train_index = index['train_index']
+                self.val_index = index['val_index']
+            
+            # Test set, the missing values of the target stay NaN
+            test = np.array(self.features[self.test_dates])
+            columns = ['var{}(t)'.format(i + 1) for i in range(test.shape[1] - 1)] + ['values(t)']
+            self.test_year = pd.DataFrame(test, columns=columns)
+            self.test_X, self.test_y = test[:, :-1], test[:, -1]
+            if self.ML in ['LSTM', 'TCN', 'TCN-LSTM']:
+                # reshape input to be 3D [samples, timesteps, features]
+                self.test_X = self.test_X.reshape((self.test_X.shape[0], 1, self.test_X.shape[1]))
+            return
         
         with open(f'{self.data_path}/data.npy', 'rb') as f:
             self.train_X = np.load(f)
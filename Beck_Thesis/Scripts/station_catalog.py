@@ -0,0 +1,90 @@
+'''
+Catalog of the station files in an input directory.
+
+Only the metadata of each file (coordinates, dimensions and variable names) and the residual series
+are read, so the full gridded data is never loaded. The catalog is stored as a csv and is updated
+incrementally: only files that are new or changed since the last build are read again.
+'''
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+CATALOG_COLUMNS = ['Station', 'start', 'end', 'length', 'n_lat', 'n_lon', 'variables', 'missing_frac',
+                   'size', 'mtime_ns']
+
+
+def catalog_entry(filename):
+    """Read the catalog entry of a single station file.
+
+    Args:
+        filename (str): Path of the station's netcdf file
+
+    Returns:
+        dict: Catalog entry with the CATALOG_COLUMNS
+    """
+    stat = os.stat(filename)
+    with xr.open_dataset(filename) as ds:
+        time = ds['time'].values
+        if 'residual' in ds:
+            missing_frac = float(np.isnan(ds['residual'].values).mean()) if len(time) else 1.0
+        else:
+            missing_frac = 1.0
+        return {'Station': os.path.split(filename)[1][:-3],
+                'start': pd.Timestamp(time.min()) if len(time) else pd.NaT,
+                'end': pd.Timestamp(time.max()) if len(time) else pd.NaT,
+                'length': len(time),
+                'n_lat': ds.sizes.get('latitude', 0),
+                'n_lon': ds.sizes.get('longitude', 0),
+                'variables': ';'.join(sorted(ds.data_vars)),
+                'missing_frac': missing_frac,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns}
+
+
+def load_catalog(catalog_file):
+    """Load a catalog written by build_catalog, indexed by station.
+
+    Args:
+        catalog_file (str): Path of the catalog csv
+
+    Returns:
+        pd.DataFrame: Catalog, empty if the file does not exist
+    """
+    if not os.path.exists(catalog_file):
+        return pd.DataFrame(columns=CATALOG_COLUMNS).set_index('Station')
+    return pd.read_csv(catalog_file, index_col='Station', parse_dates=['start', 'end'],
+                       keep_default_na=False, na_values={'start': [''], 'end': ['']})
+
+
+def build_catalog(input_dir, catalog_file=None):
+    """Build or update the catalog of all station files in a directory.
+
+    Files whose size and modification time match the stored entry are not read again,
+    and entries of files that no longer exist are dropped.
+
+    Args:
+        input_dir (str): Directory of the station netcdf files
+        catalog_file (str, optional): Path of the catalog csv. Defaults to <input_dir>/catalog.csv.
+
+    Returns:
+        pd.DataFrame: Catalog indexed by station
+    """
+    catalog_file = os.path.join(input_dir, 'catalog.csv') if catalog_file is None else catalog_file
+    catalog = load_catalog(catalog_file)
+
+    entries = []
+    for filename in sorted(glob.glob(os.path.join(input_dir, '*.nc'))):
+        station = os.path.split(filename)[1][:-3]
+        stat = os.stat(filename)
+        if (station in catalog.index and catalog.loc[station, 'size'] == stat.st_size
+                and catalog.loc[station, 'mtime_ns'] == stat.st_mtime_ns):
+            entries.append({'Station': station, **catalog.loc[station].to_dict()})
+        else:
+            entries.append(catalog_entry(filename))
+
+    catalog = pd.DataFrame(entries, columns=CATALOG_COLUMNS).set_index('Station')
+    catalog.to_csv(catalog_file)
+    return catalog
@@ -8,6 +8,7 @@ Timothy Tiggeloven and Anaïs Couasnon
 import numpy as np
 import os
 import pandas as pd
+import shutil
 from sklearn.preprocessing import MinMaxScaler, PowerTransformer, StandardScaler, QuantileTransformer
 from sklearn.pipeline import make_pipeline
 import sys
@@ -15,6 +16,9 @@ import time
 import xarray as xr
 from station import Station
 import random as rand
+from functools import lru_cache, reduce
+import feature_store
+import station_catalog
 
 def series_to_supervised(data, n_in=1, n_out=1, dropnan=True):
     # convert series to supervised learning
@@ -40,51 +44,75 @@ def series_to_supervised(data, n_in=1, n_out=1, dropnan=True):
         agg.dropna(inplace=True)
     return agg
 
+def float32_values(df, columns, out=None):
+    # values of the columns as one float32 array, filled column by column without an intermediate copy of the frame
+    if out is None:
+        out = np.empty((len(df), len(columns)), dtype=np.float32)
+    for i, col in enumerate(columns):
+        out[:, i] = df[col].values
+    return out
+
+def partial_fit_scaler(scaler, values, mask, chunk=100000):
+    # fit the scaler on the rows in mask with partial_fit on chunks of rows,
+    # running min and max for MinMaxScaler and incremental mean and variance for StandardScaler
+    for i in range(0, len(values), chunk):
+        train = values[i:i + chunk][mask[i:i + chunk]]
+        if len(train):
+            scaler.partial_fit(train)
+    return scaler
+
+def transform_inplace(scaler, values, chunk=100000):
+    # transform the values in chunks of rows, overwriting the input
+    for i in range(0, len(values), chunk):
+        values[i:i + chunk] = scaler.transform(values[i:i + chunk])
+    return values
+
 def reframe_scale(df, timesteps, scaler_type='MinMax', year='last', prior=False, scaler_op=True):
-    df2 = df.copy(deep=True)
+    df2 = df
     
     #Removing the testing data before transformation
     if year == 'random' or year == 'last':
-        dates, _ = draw_sample(df2, 'residual', timesteps, threshold=0, year=year)
+        begin_ID, end_ID = test_window(df2['residual'].values.astype(float), timesteps, threshold=0, year=year)
     else:
-        dates = df2.iloc[-timesteps:].index.values
+        begin_ID, end_ID = len(df2) - timesteps, len(df2)
         
-    i_dates = np.array([df2.index.get_loc(date) for date in dates])
-    all_index = df2.reset_index().index.values
-    train_index = np.delete(all_index, i_dates)
+    dates = df2.index.values[begin_ID:end_ID]
+    i_dates = np.arange(begin_ID, end_ID)
+    train_mask = np.ones(len(df2), dtype=bool)
+    train_mask[begin_ID:end_ID] = False
     
+    cols = df2.columns.tolist()
     if not prior:
-        cols = df2.columns.tolist()
-        df2 = df2[cols[1:] + cols[:1]]
-    values = df2.values
+        cols = cols[1:] + cols[:1]
 
-    # ensure all data is float
-    values = values.astype('float32')
+    # ensure all data is float, in a single buffer that is scaled in place
+    values = float32_values(df2, cols)
 
     # normalize features on training data only
     if scaler_op == True:
-        train = values[train_index, :]        
         # n_train_hours = int(values.shape[0] * tt_value)
         # train = values[:n_train_hours, :]
 
         if scaler_type == 'MinMax':
             scaler = MinMaxScaler(feature_range=(0, 1))
-            scaler = scaler.fit(train)
+            scaler = partial_fit_scaler(scaler, values, train_mask)
         elif scaler_type == 'std_normal':
             scaler = StandardScaler()
-            scaler = scaler.fit(train)
+            scaler = partial_fit_scaler(scaler, values, train_mask)
         elif scaler_type == 'yeo-johnson':
             #Cannot use Yeo-johnson as is because of a bug in scipy so making this small way around - Using https://github.com/scikit-learn/scikit-learn/issues/14959
             #preprocessor = make_pipeline(QuantileTransformer(output_distribution='uniform'),PowerTransformer(standardize=True))
+            # no partial_fit for the quantiles, so this is fitted on a copy of the training data
             preprocessor = make_pipeline(QuantileTransformer(output_distribution='normal'),PowerTransformer(standardize=True))
-            scaler = preprocessor.fit(train)
+            scaler = preprocessor.fit(values[train_mask, :])
         else:
             print('Could not read your choice, going with MinMax Scaler')
             scaler = MinMaxScaler(feature_range=(0, 1))
-            scaler = scaler.fit(train)
+            scaler = partial_fit_scaler(scaler, values, train_mask)
 
-        scaled = scaler.transform(values)
+        scaled = transform_inplace(scaler, values)
     else:
+        scaler = None
         scaled = values
 
     # frame as supervised learning
@@ -93,68 +121,170 @@ def reframe_scale(df, timesteps, scaler_type='MinMax', year='last', prior=False,
         # drop columns we don't want to predict
         reframed.drop(reframed.columns[5:], axis=1, inplace=True)
     else:
-        columns = ['var{}(t)'.format(i + 1) for i in range(len(df2.columns) - 1)]
+        columns = ['var{}(t)'.format(i + 1) for i in range(len(cols) - 1)]
         columns.append('values(t)')
         reframed = pd.DataFrame(scaled, columns=columns)
     
     return reframed, scaler, scaled, dates, i_dates
 
+def rolling_mean_time(values, times, window, block=4096):
+    # time based rolling mean over (t - window, t] from cumulative sums, ignoring NaN (like df.rolling(window).mean())
+    times = times.astype('datetime64[ns]').view('int64')
+    start = np.searchsorted(times, times - window.value, side='right')
+    valid = ~np.isnan(values)
+    offset = np.nanmean(values, axis=0, dtype=np.float64) if valid.any() else 0 # remove the mean for a more precise cumulative sum
+    
+    csum = np.zeros((len(values) + 1, values.shape[1]))
+    np.subtract(values, offset, out=csum[1:])
+    if valid.all():
+        count = (np.arange(1, len(values) + 1) - start)[:, None]
+    else:
+        csum[1:][~valid] = 0
+        ccount = np.zeros(csum.shape, dtype=np.int64)
+        np.cumsum(valid, axis=0, out=ccount[1:])
+        count = ccount[1:] - ccount[start]
+    np.cumsum(csum, axis=0, out=csum)
+    
+    # the differences are taken in blocks of rows, so the only full size arrays are csum and the output
+    rolling_mean = np.empty(values.shape, dtype=values.dtype)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(0, len(values), block):
+            rows = slice(i, i + block)
+            rolling_mean[rows] = (csum[i + 1:i + 1 + block] - csum[start[rows]]) / count[rows] + offset
+    return rolling_mean
+
+def daily_buckets(times):
+    # day number of every timestep since the first day, the first row of every day with data and its day number
+    days = ((times - times[0].astype('datetime64[D]')) // np.timedelta64(1, 'D')).astype(int)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    return days, starts, days[starts]
+
+def to_daily(values, times, day_ids):
+    # place the values of the days with data on a complete daily index (like resample('24H')), days without data are NaN
+    daily = np.full((day_ids[-1] + 1, values.shape[1]), np.nan, dtype=values.dtype)
+    daily[day_ids] = values
+    return daily, pd.date_range(times[0].astype('datetime64[D]'), periods=len(daily), freq='24H')
+
 def resample_rolling(df, lat_list, lon_list, variables, resample, resample_method, make_univariate):
     # df = df.rolling('12H').mean()
     # df['residual'] = df['residual'].rolling('12H').mean().values
-    df = df.copy()
+    # Resampling works on the underlying array with a daily bucket index, no intermediate DataFrames are made
+    values = source = df.values
+    index = df.index
+    columns = list(df.columns)
     if resample == 'hourly' and resample_method == 'raw':
         step = 24
-        df = df.copy()
     elif resample == 'hourly' and resample_method == 'rolling_mean':
         step = 24
-        df = df.rolling('12H').mean()
+        values = rolling_mean_time(values, index.values, pd.Timedelta('12H'))
         # df['residual'] = df['residual'].rolling('12H').mean().values
     elif resample == 'daily' and resample_method == 'res_max':
         step = 1
-        index_var_name = 'msl_{}_{}'.format(lat_list[int(len(lat_list)/2)], lon_list[int(len(lon_list)/2)])
-        index = df[index_var_name].loc[df.groupby(pd.Grouper(freq='D')).idxmax().iloc[:, 0]].index
-        df_res = df['residual'].resample('24H').max().to_frame()
+        days, starts, day_ids = daily_buckets(index.values)
+        
+        # first time of the maximum residual of every day
+        res = df['residual'].values
+        res_max = np.fmax.reduceat(res, starts)
+        i_max = np.flatnonzero(res == res_max[np.searchsorted(day_ids, days)])
+        i_max = i_max[np.r_[True, days[i_max][1:] != days[i_max][:-1]]]
+        
+        # residual is the daily maximum, msl and grad the daily maximum of every cell,
+        # the other variables are taken at the time of the daily maximum residual
+        daily_columns = ['residual']
+        daily_parts = [res_max[:, None]]
         for var in variables:
-            df_var = df.loc[:, df.columns.str.startswith(var)]
+            i_var = [i for i, col in enumerate(columns) if col.startswith(var)]
+            daily_columns += [columns[i] for i in i_var]
             if var != 'msl' and var != 'grad':
-                df_var  = df_var.loc[index, :]
-            # df_var  = df_var.loc[index, :]
-            df_var = df_var.resample('24H').max()
-            df_res = df_res.merge(df_var, how='left', right_index=True, left_index=True)
-        df = df_res.copy()
+                var_max = np.full((len(starts), len(i_var)), np.nan, dtype=values.dtype)
+                var_max[np.searchsorted(day_ids, days[i_max])] = values[np.ix_(i_max, i_var)]
+            elif i_var:
+                var_max = np.fmax.reduceat(values[:, i_var], starts, axis=0)
+            else:
+                var_max = np.empty((len(starts), 0), dtype=values.dtype)
+            daily_parts.append(var_max)
+        values, index = to_daily(np.concatenate(daily_parts, axis=1), index.values, day_ids)
+        columns = daily_columns
     elif resample == 'daily' and resample_method == 'max':
         step = 1
-        df = df.resample('24H').max()
+        days, starts, day_ids = daily_buckets(index.values)
+        values, index = to_daily(np.fmax.reduceat(values, starts, axis=0), index.values, day_ids)
         
     if make_univariate == True:
+        # every variable is replaced by a single column with its maximum over all columns containing its name
+        arrays = [values[:, i] for i in range(values.shape[1])]
         for var in variables:
             print(var)
-            var_cols = [col for col in df.columns if var in col]
-            df.loc[:,var] = df.loc[:,var_cols].max(axis = 1)
-            df.drop(var_cols, axis = 1, inplace = True)            
+            var_cols = [i for i, col in enumerate(columns) if var in col]
+            var_max = reduce(np.fmax, [arrays[i] for i in var_cols]) if var_cols else np.full(len(values), np.nan)
+            new_column = var not in columns
+            columns = [col for i, col in enumerate(columns) if i not in var_cols]
+            arrays = [arr for i, arr in enumerate(arrays) if i not in var_cols]
+            if new_column:
+                columns.append(var)
+                arrays.append(var_max)
+        values = np.column_stack(arrays) if arrays else np.empty((len(values), 0))
     
-    return df, step
+    if values is source:
+        return df, step
+    return pd.DataFrame(values, index=pd.Index(index, name=df.index.name), columns=columns, copy=False), step
+
+# SST series per station, written by Get_SST_Data.get_sst_data as <station>_sst.nc
+SST_DIR = 'Input_sst_data'
+
+def sst_file(station_name, sst_dir):
+    return os.path.join(sst_dir, station_name + '_sst.nc')
+
+def join_sst(ds, station_name, sst_dir):
+    # lazily add the SST series stored next to the gridded data, aligned to its time axis
+    # this is the default SST route, the gridded station file is not copied or rewritten
+    sst = xr.open_dataset(sst_file(station_name, sst_dir))['sst']
+    ds['sst'] = sst.reindex(time=ds['time'])
+    return ds
+
+def append_sst(filename, sst, output_file=None):
+    # write an SST series into a station file, aligned to its time axis
+    # only needed to make a self-contained station file with SST, by default the SST is joined at load time (join_sst)
+    # with output_file, the file is copied there first and the SST is written to the copy, so the input stays untouched
+    if output_file is not None:
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        shutil.copyfile(filename, output_file)
+        filename = output_file
+    with xr.open_dataset(filename) as ds:
+        time = ds['time'].load()
+    sst = sst.reindex(time=time).drop_vars('time')
+    sst.to_dataset(name='sst').to_netcdf(filename, mode='a')
+
+STATION_ALIASES = {'Cuxhaven': 'cuxhaven-cuxhaven-germany-bsh',
+                   'Hoek van Holland': 'hoekvanholla-hvh-nl-rws',
+                   'Puerto Armuelles': 'puerto_armuelles_b-304b-panama-uhslc'}
+
+@lru_cache(maxsize=None)
+def station_registry(stations_file=os.path.join('Stations', 'Selected_Stations_w_Data.csv')):
+    """Station metadata (coast, direction, train/test split, lat/lon, ...) indexed by station name.
+    The file is only read once per process, later calls return the same dataframe.
 
-def load_file(station, input_dir):
+    Args:
+        stations_file (str, optional): Csv with a row per station. Defaults to 'Stations/Selected_Stations_w_Data.csv'.
 
-    if station == 'Cuxhaven':
-        station_name = 'cuxhaven-cuxhaven-germany-bsh'
-    elif station == 'Hoek van Holland':
-        station_name = 'hoekvanholla-hvh-nl-rws'
-    elif station == 'Puerto Armuelles':
-        station_name = 'puerto_armuelles_b-304b-panama-uhslc'
-    else:
-        station_name = station
-        # sys.exit('Station name not found!')
+    Returns:
+        pd.DataFrame: Station metadata, indexed by station name (the 'Station' column is kept)
+    """
+    return pd.read_csv(stations_file).dropna().set_index('Station', drop=False)
+
+def load_file(station, input_dir, sst_dir=None):
+    # with sst_dir, the SST series of the station is joined from <sst_dir>/<station>_sst.nc (see join_sst)
+
+    station_name = STATION_ALIASES.get(station, station)
     filename = os.path.join(input_dir, station_name + '.nc')
 
-    df_dir = pd.read_excel(os.path.join('Stations', 'stations.xlsx'))
-    # direction = df_dir['Direction'][df_dir['Station'] ==  station_name].values[0]
+    # direction = station_registry().loc[station_name, 'Direction']
     direction = 'N'
 
     # read in variables
     ds = xr.open_dataset(filename)
+    if sst_dir is not None:
+        ds = join_sst(ds, station_name, sst_dir)
     df = ds[['gesla_swl', 'tide_wtrend', 'residual']].to_dataframe()
     # df = df.rolling('12H').mean()
     return df, ds, direction
@@ -165,25 +295,44 @@ def select_extremes(df, percent):
     extreme_dates = extremes.index.values
     return extreme_dates, df.loc[extreme_dates,:]
 
+def run_count(mask):
+    # number of consecutive True values up to and including every position, 0 where mask is False
+    mask = np.asarray(mask, dtype=bool)
+    position = np.arange(len(mask))
+    last_false = np.maximum.accumulate(np.where(mask, -1, position))
+    return np.where(mask, position - last_false, 0)
+
+def run_lengths(mask):
+    # start positions and lengths of the runs of consecutive True values
+    edges = np.diff(np.concatenate([[0], np.asarray(mask, dtype=np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    return starts, np.flatnonzero(edges == -1) - starts
+
+def nan_runs(values, threshold=0):
+    """Run-length encoding of the missing values of a series.
+
+    Args:
+        values (np.array): Values of the series
+        threshold (int, optional): Number of consecutive NaN that are still allowed in a valid run. Defaults to 0.
+
+    Returns:
+        np.array, np.array, np.array, np.array: start positions and lengths of the gaps (runs of consecutive NaN),
+            and start positions and lengths of the valid runs (without more than threshold consecutive NaN)
+    """
+    isnan = np.isnan(values)
+    gap_starts, gap_lengths = run_lengths(isnan)
+    valid_starts, valid_lengths = run_lengths(run_count(isnan) <= threshold)
+    return gap_starts, gap_lengths, valid_starts, valid_lengths
+
 def calc_na_notna(df, col):
     
-    # df_test = pd.DataFrame(df['residual'])
-    df_test = pd.DataFrame(df[col])
-    
-    #Count nb of null
-    count_df = pd.concat([df_test, (df_test.loc[:,col].isnull().astype(int).groupby(df.loc[:,col].notnull().astype(int).cumsum()).cumsum().to_frame('na_consec_count'))], axis=1)    
-    # compute mask where np.nan = True
-    mask = pd.isna(df_test).astype(bool)    
-    # compute cumsum across rows fillna with ffill
-    cumulative = df_test.astype(bool).cumsum().fillna(method='ffill', axis=0).fillna(0)    
-    # get the values of cumulative where nan is True use the same method
-    restart = cumulative[mask].fillna(method='ffill', axis=0).fillna(0)    
-    # set the result
-    result = (cumulative - restart)
-    result[mask] = np.nan
-    result.rename(columns = {result.columns[0]:'notna_consec_count'}, inplace = True)
+    # Count the number of consecutive null and not null values at every timestep
+    isnan = df[col].isnull().values
+    notna_count = run_count(~isnan).astype(float)
+    notna_count[isnan] = np.nan
     
-    count_df = pd.concat([count_df, result], axis = 1)
+    count_df = pd.DataFrame({col: df[col].values, 'na_consec_count': run_count(isnan), 'notna_consec_count': notna_count},
+                            index=df.index)
     count_df.reset_index(inplace = True)
     return count_df
 
@@ -195,113 +344,140 @@ def select_testing_year(count_df, step = 1):
     
     return validation_year
 
-def select_ensemble(df, col, ML, batch, tt_value=0.7, frac_ens=0.5, mask_val=-999, NaN_threshold=0):
-    df = df.copy()
-    pool = df.index.values
-    if ML == 'CNN' or ML == 'ANN':
-        df = df[df[col].notnull()]
-        random_draw = np.random.choice(len(df), size=int(len(df)*frac_ens), replace=False)
-        random_pool = pool[random_draw]
-        df_draw = df.iloc[random_pool,:]
-        n_train = int(len(df_draw) * tt_value)
-        df_draw = df_draw.reset_index(drop = True)
-        validation_data = None
-        sequences = None
-    elif ML in ['LSTM', 'TCN', 'TCN-LSTM']:
-        # count consecutive NaN
-        na_count = df[col].isnull().astype(int).groupby(df[col].notnull().astype(int).cumsum()).cumsum()
-        na_count[na_count > 0] = np.nan  # 7*24
+def valid_windows(isnan, batch, start):
+    # start positions of the consecutive windows of batch timesteps from start onwards that contain no NaN
+    # all windows are scored at once from the cumulative NaN count
+    n_windows = max(int(len(isnan) / batch) - 1, 0)
+    starts = start + batch * np.arange(n_windows)
+    nan_count = np.concatenate([[0], np.cumsum(isnan)])
+    return starts[nan_count[starts + batch] == nan_count[starts]]
 
-        # binary na identification
-        na_binary = na_count.copy()
-        na_binary[na_binary > 0] = 1
+def ensemble_indices(isnan, ML, batch, tt_value=0.7, frac_ens=0.5):
+    """Randomly draw the timesteps of an ensemble member, as positions in the (reframed) data.
 
-        # randomly select start of batch
+    Args:
+        isnan (np.array): Whether the target is missing at every timestep
+        ML (str): Type of model. ANN and CNN draw single timesteps, LSTM, TCN and TCN-LSTM draw sequences of batch timesteps
+        batch (int): Number of timesteps in a sequence
+        tt_value (float, optional): Fraction of the drawn data used for training. Defaults to 0.7.
+        frac_ens (float, optional): Fraction of the available data that is drawn. Defaults to 0.5.
+
+    Returns:
+        np.array, int: positions of the drawn timesteps (training first, then validation), number of training timesteps
+    """
+    if ML == 'CNN' or ML == 'ANN':
+        valid = np.flatnonzero(~isnan)
+        random_draw = np.random.choice(len(valid), size=int(len(valid)*frac_ens), replace=False)
+        draw = valid[random_draw]
+        n_train = int(len(draw) * tt_value)
+    elif ML in ['LSTM', 'TCN', 'TCN-LSTM']:
+        # randomly select start of batch and find the sequences without NaN (consecutive NaN of more than 0 timesteps, 7*24)
         start = np.random.randint(0, batch)
-        end = batch + start
-        sequences = []
-        for i in range(int(len(df) / batch) - 1):
-            if np.all(na_count[start:end].notnull()) and na_binary[start:end].sum() < batch * 0.25:
-                sequences.append(pool[start:end])
-            start += batch
-            end += batch
-        sequences = np.array(sequences)
+        sequences = valid_windows(isnan, batch, start)
         if len(sequences) < 20: #26
             print(f'Number of random sequences found was lower than 20 with: {len(sequences)}')
             #sys.exit(0)
         random_draw = np.random.choice(len(sequences), size=int(len(sequences)*frac_ens), replace=False)
         random_sequences = sequences[random_draw]
-        random_sequences_train = random_sequences[:int(len(random_sequences)*tt_value)].flatten()
-        random_sequences_valid = random_sequences[int(len(random_sequences)*tt_value):].flatten()
-        df_train = df.loc[random_sequences_train]
-        df_valid = df.loc[random_sequences_valid]
-        n_train = len(df_train)
-        df_draw = pd.concat([df_train, df_valid])
+        
+        # positions of the timesteps of the drawn train and validation sequences
+        n_seq_train = int(len(random_sequences)*tt_value)
+        draw = (random_sequences[:, None] + np.arange(batch)).ravel()
+        n_train = n_seq_train * batch
+    return draw, n_train
+
+def select_ensemble(df, col, ML, batch, tt_value=0.7, frac_ens=0.5, mask_val=-999, NaN_threshold=0):
+    draw, n_train = ensemble_indices(df[col].isnull().values, ML, batch, tt_value=tt_value, frac_ens=frac_ens)
+    df_draw = df.iloc[draw]
+    if ML == 'CNN' or ML == 'ANN':
+        df_draw = df_draw.reset_index(drop = True)
+    elif ML in ['LSTM', 'TCN', 'TCN-LSTM']:
+        df_draw = df_draw.copy()
         df_draw[df_draw.isnull()] = mask_val
     return df_draw, n_train
 
-def draw_sample(df, col, timesteps, threshold=0, year='last'):
-    """ 
-    select from pool of dates where there are no consecutive NaN of more than 7 days
+class NoTestWindowError(ValueError):
+    """No window of the requested length satisfies the NaN constraints"""
+
+def test_window_ends(values, timesteps, threshold=0, max_nan=0.25):
+    """End positions of all windows of timesteps without more than threshold consecutive NaN
+    and with less than max_nan NaN, found in one pass with cumulative counts.
+
+    Args:
+        values (np.array): Values of the series
+        timesteps (int): Length of the window
+        threshold (int, optional): Number of consecutive NaN that are still allowed. Defaults to 0.
+        max_nan (float, optional): Fraction of NaN that is allowed in the window. Defaults to 0.25.
+
+    Returns:
+        np.array: End positions (exclusive) of the windows, increasing
     """
-    # count timesteps in 5 years and insert ID's
-    df = df.copy()    
-    df.insert(0, 'ID', range(0, len(df)))
-    
-    df_dates = df.index
-    df = df.reset_index(drop= True)
-
-    # count consecutive NaN
-    na_count = df[col].isnull().astype(int).groupby(df[col].notnull().astype(int).cumsum()).cumsum()
-
-    # count consecutive timesteps without consecutive NaN of more than 'threshold' days
-    na_count[na_count > threshold] = np.nan
-    value_count = na_count.notnull().astype(int).groupby(na_count.isnull().astype(int).cumsum()).cumsum()
-
-    # binary na identification
-    na_binary = na_count.copy()
-    na_binary[na_binary > 0] = 1
-
-    # create pool of dates and randomly select dates interval
-    pool = value_count[value_count > timesteps].index.values
-    if len(pool) < 1:
-        #sys.exit(f'No consecutive {timesteps} timesteps found without specified NaN interval')
-        # Raise an error
-        raise ValueError(f'No consecutive {timesteps} timesteps found without specified NaN interval')
-    
+    na = np.isnan(values)
+    na_long = run_count(na) > threshold
+
+    # the window before an end position lies within a run without consecutive NaN of more than 'threshold'
+    ends = np.flatnonzero(run_count(~na_long) > timesteps)
+    if len(ends) < 1:
+        raise NoTestWindowError(f'No consecutive {timesteps} timesteps found without specified NaN interval')
+
+    # check if at least has 75% values
+    na_count = np.concatenate([[0], np.cumsum(na)])
+    ends = ends[na_count[ends] - na_count[ends - timesteps] < timesteps * max_nan]
+    if len(ends) < 1:
+        raise NoTestWindowError(f'No consecutive {timesteps} timesteps found with less than {max_nan:.0%} NaN')
+    return ends
+
+def test_window(values, timesteps, threshold=0, year='last'):
+    # first and last (exclusive) position of the last or a random window of test_window_ends
+    ends = test_window_ends(values, timesteps, threshold)
     if year == 'random':
-        # check if at least has 75% values
-        check, count = False, 0
-        while check == False:
-            if count > 20:
-                sys.exit(f'No consecutive {timesteps} timesteps found with less than 25% NaN')
-            end_date = pool[np.random.randint(0, len(pool))]
-            end_ID = df.ID.loc[end_date]
-            begin_ID = end_ID - timesteps
-            if np.all(na_count[begin_ID:end_ID].notnull()) and na_binary[begin_ID:end_ID].sum() < timesteps * 0.25:
-                check = True
-            count += 1
+        end_ID = ends[np.random.randint(0, len(ends))]
     elif year == 'last':
-        for end_date in reversed(pool):
-            end_ID = df.ID.loc[end_date]
-            begin_ID = end_ID - timesteps
-            if np.all(na_count[begin_ID:end_ID].notnull()) and na_binary[begin_ID:end_ID].sum() < timesteps * 0.25:
-                break
-    dates = df_dates.values[begin_ID:end_ID]
-    #dates = df.index.values[begin_ID:end_ID]
+        end_ID = ends[-1]
+    else:
+        raise ValueError(f"year must be 'last' or 'random', not {year!r}")
+    return end_ID - timesteps, end_ID
+
+def draw_sample(df, col, timesteps, threshold=0, year='last'):
+    """ 
+    select from pool of dates where there are no consecutive NaN of more than 'threshold' timesteps,
+    the last window or a random one. Raises NoTestWindowError when there is no such window.
+    """
+    begin_ID, end_ID = test_window(df[col].values.astype(float), timesteps, threshold, year)
+
+    dates = df.index.values[begin_ID:end_ID]
     df = df.iloc[begin_ID:end_ID].copy()
-    df.drop(['ID'], axis=1, inplace=True)
     df.set_index(dates, inplace = True)
     return dates, df
 
-def prescreening(station_list, input_dir, batch, threshold=0):
+def prescreening(station_list, input_dir, batch, threshold=0, catalog=None):
     df_screening = pd.DataFrame(columns=['station', 'years', 'years_rand', 'available'])
     cons_sequences_threshold = 2600 / batch
     batch = batch * 24
+    df = None
     for station in station_list:
         # station = 'abashiri-abashiri-japan-jma'
         station = os.path.split(station)[1][:-3]
         print(station)
+
+        # use the station catalog (see station_catalog.build_catalog) to skip loading when possible
+        if catalog is not None and station in catalog.index:
+            entry = catalog.loc[station]
+            if 'residual' not in entry['variables'].split(';') or entry['length'] < 365 * 24:
+                # less than a year of data, station can not be suitable
+                new_row = {'station':station, 'years':0, 'sequences':0, 'available':False}
+                df_screening = df_screening.append(new_row, ignore_index=True)
+                continue
+            if entry['missing_frac'] == 0:
+                # dataset has no NaN values, the record length is enough
+                cons_years = np.floor(entry['length'] / (365 * 24))
+                cons_sequences = np.floor(entry['length'] / (batch))
+                available = True if cons_years >= 1 and cons_sequences >= cons_sequences_threshold else False
+                new_row = {'station':station, 'years':cons_years, 'sequences':cons_sequences,
+                           'available':available}
+                df_screening = df_screening.append(new_row, ignore_index=True)
+                continue
+
         # load dataset
         df, ds, direction = load_file(station, input_dir)
 
@@ -312,32 +488,14 @@ def prescreening(station_list, input_dir, batch, threshold=0):
         try:
             # check NaN in dataset (75% not NaN)
             if df['residual'].isnull().astype(int).sum() > 0:
-                # count consecutive NaN
-                na_count = df['residual'].isnull().astype(int).groupby(df['residual'].notnull().astype(int).cumsum()).cumsum()
-
-                # count consecutive timesteps without consecutive NaN of more than 'threshold' days
-                na_count[na_count > threshold] = np.nan
-                value_count = na_count.notnull().astype(int).groupby(na_count.isnull().astype(int).cumsum()).cumsum()
-
-                # find local max in series
-                local_max = value_count[(value_count.shift(1) < value_count) & (value_count.shift(-1) < value_count)]
-                if value_count[-1:].values[0] > 0:
-                    new_data = pd.DataFrame(value_count[-1:].values, index=value_count.index.values[-1:])
-                    local_max = local_max.append(new_data)
+                # lengths of consecutive timesteps without consecutive NaN of more than 'threshold' days
+                _, _, _, valid_lengths = nan_runs(df['residual'].values, threshold)
 
                 # count consecutive years in series
-                cons_years = local_max.copy()
-                try:
-                    cons_years = np.floor(cons_years / (365 * 24)).sum().values[0]
-                except:
-                    cons_years = np.floor(cons_years / (365 * 24)).sum()
+                cons_years = np.floor(valid_lengths / (365 * 24)).sum()
 
                 # count consecutive sequences in series
-                cons_sequences = local_max.copy()
-                try:
-                    cons_sequences = np.floor(cons_sequences / (batch)).sum().values[0]
-                except:
-                    cons_sequences = np.floor(cons_sequences / (batch)).sum()
+                cons_sequences = np.floor(valid_lengths / (batch)).sum()
             
                 # # count random consecutive years in series
                 # pool = df.index.values
@@ -383,29 +541,24 @@ def prescreening(station_list, input_dir, batch, threshold=0):
     return df_screening, df
 
 def spatial_to_column(df, ds, variables, selected_dates, n_ncells):
-    df = df.copy()
-    df0 = df.copy()
     if len(selected_dates)>0:
-        df = df.loc[selected_dates,:].copy()
+        df = df.loc[selected_dates,:]
 
     middle = int(len(ds.longitude)/2)
-    lon_list = ds.longitude.values[middle - n_ncells: middle + n_ncells + 1]
-    lat_list = ds.latitude.values[middle - n_ncells: middle + n_ncells + 1]
-
-    # extract all gridded data to columns
-    for lat in lat_list:
-        df2 = df0.copy()
-        for lon in lon_list:    
-            if len(selected_dates)>0:
-                dfi = ds[variables].sel(latitude=lat, longitude=lon, time=selected_dates).to_dataframe().drop(['latitude', 'longitude'], axis = 1)
-            else:
-                dfi = ds[variables].sel(latitude=lat, longitude=lon).to_dataframe().drop(['latitude', 'longitude'], axis = 1)
-            dfi.columns = [col + '_{}_{}'.format(lat, lon) for col in dfi.columns]            
-            df2 = df2.merge(dfi, how='left', right_index=True, left_index=True)
-            del dfi
-        df = df.merge(df2.drop(['tide_wtrend', 'gesla_swl','residual'], axis = 1), how='left', right_index=True, left_index=True)
-    df.drop(['tide_wtrend', 'gesla_swl'], axis=1, inplace=True)
-    return df, lat_list, lon_list
+    box = slice(middle - n_ncells, middle + n_ncells + 1)
+    lon_list = ds.longitude.values[box]
+    lat_list = ds.latitude.values[box]
+
+    # extract all gridded data to columns in one selection, aligned to the time index of df
+    # (time, latitude, longitude, variable) is flattened so the columns are ordered per latitude, longitude and then variable
+    grid = (ds[variables].isel(latitude=box, longitude=box)
+            .reindex(time=df.index.values)
+            .to_array('variable')
+            .transpose('time', 'latitude', 'longitude', 'variable'))
+    columns = ['{}_{}_{}'.format(var, lat, lon) for lat in lat_list for lon in lon_list for var in variables]
+    df_grid = pd.DataFrame(grid.values.reshape(len(df), -1), index=df.index, columns=columns, copy=False)
+    df_grid.insert(0, 'residual', df['residual'].values)
+    return df_grid, lat_list, lon_list
 
 def column_to_spatial(reframed, columns, lat_list, lon_list, variables, ML, direction):
     reframed = reframed.copy()
@@ -490,42 +643,73 @@ def split_tt(reframed, ML, tt_value, n_train):
 
 def prepare_station(station, variables, ML, input_dir, resample, resample_method,
                     cluster_years=5, extreme_thr=0.02, sample=False, make_univariate=False,
-                    scaler_type='std_normal', year = 'last', scaler_op=True, n_ncells=2, mask_val=-999, logger=False):
+                    scaler_type='std_normal', year = 'last', scaler_op=True, n_ncells=2, mask_val=-999, logger=False,
+                    feature_dir=None, sst_dir=SST_DIR):
     start = time.time()    
 
-    # read in variables
-    df, ds, direction = load_file(station, input_dir)
-    # print('Station is loaded')
-
-    if sample == 'cluster':
-        print(f'Selecting {cluster_years} years of data')
-        selected_dates, df = draw_sample(df, cluster_years * 365 * 24, 24, threshold=7)
-    elif sample == 'extreme':
-        print(f'Selecting top {extreme_thr} of data')
-        selected_dates, df = select_extremes(df, extreme_thr)
+    # The SST is joined from its own file at load time, only when it is a desired variable
+    station_name = STATION_ALIASES.get(station, station)
+    sst_dir = sst_dir if 'sst' in variables else None
+    sources = [os.path.join(input_dir, station_name + '.nc')]
+    if sst_dir is not None:
+        sources.append(sst_file(station_name, sst_dir))
+
+    # Load the prepared data from the feature store if the station was prepared with the same settings before
+    features = None
+    if feature_dir is not None:
+        key = feature_store.feature_key(sources,
+                                        station=station, variables=variables, resample=resample, resample_method=resample_method,
+                                        cluster_years=cluster_years, extreme_thr=extreme_thr, sample=sample, make_univariate=make_univariate,
+                                        scaler_type=scaler_type, year=year, scaler_op=scaler_op, n_ncells=n_ncells)
+        features = feature_store.load_features(key, feature_dir)
+
+    if features is not None:
+        df, lat_list, lon_list, direction, step = (features[name] for name in ['df', 'lat_list', 'lon_list', 'direction', 'step'])
     else:
-        selected_dates = []
+        # read in variables
+        df, ds, direction = load_file(station, input_dir, sst_dir)
+        # print('Station is loaded')
+
+        if sample == 'cluster':
+            print(f'Selecting {cluster_years} years of data')
+            selected_dates, df = draw_sample(df, cluster_years * 365 * 24, 24, threshold=7)
+        elif sample == 'extreme':
+            print(f'Selecting top {extreme_thr} of data')
+            selected_dates, df = select_extremes(df, extreme_thr)
+        else:
+            selected_dates = []
 
-    
-    if n_ncells > 0:
-        df, lat_list, lon_list = normalize_coast_orientation(ds, direction, variables, n_ncells)
-    else:
-        df, lat_list, lon_list = spatial_to_column(df, ds, variables, selected_dates, n_ncells)
-        # print('df to spatial done')    
+        
+        if n_ncells > 0:
+            df, lat_list, lon_list = normalize_coast_orientation(ds, direction, variables, n_ncells)
+        else:
+            df, lat_list, lon_list = spatial_to_column(df, ds, variables, selected_dates, n_ncells)
+            # print('df to spatial done')    
 
-    # Drop missing values
-    df.dropna(inplace=True)
-    
-    # resample or rolling mean
-    df, step = resample_rolling(df, lat_list, lon_list, variables, resample, resample_method, make_univariate)
-    # df = df[df['residual'].notna()].copy()
-    # print('Resampling done')  
+        # Drop missing values
+        df.dropna(inplace=True)
+        
+        # resample or rolling mean
+        df, step = resample_rolling(df, lat_list, lon_list, variables, resample, resample_method, make_univariate)
+        # df = df[df['residual'].notna()].copy()
+        # print('Resampling done')  
     
     timesteps = int(365 * step)
 
     # reframe and scale data
-    reframed, scaler, scaled, dates, i_dates = reframe_scale(df, timesteps, scaler_type=scaler_type, year = year, scaler_op=scaler_op)
-    # reframed_df = reframed.copy()
+    if features is not None and 'reframed' in features:
+        reframed, scaler, dates, i_dates = (features[name] for name in ['reframed', 'scaler', 'dates', 'i_dates'])
+    else:
+        reframed, scaler, scaled, dates, i_dates = reframe_scale(df, timesteps, scaler_type=scaler_type, year = year, scaler_op=scaler_op)
+        # reframed_df = reframed.copy()
+
+    if feature_dir is not None and features is None:
+        if year == 'random':
+            # The random test year has to be drawn again in every run, so only the unscaled data is stored
+            feature_store.save_features(key, df, lat_list, lon_list, direction, step, feature_dir=feature_dir)
+        else:
+            feature_store.save_features(key, df, lat_list, lon_list, direction, step, reframed, scaler, dates, i_dates,
+                                        feature_dir=feature_dir)
 
     if logger:
         logger.info(f'done preparing data for {station}: {time.time()-start: .2f} sec')
@@ -549,12 +733,14 @@ def splitting_learning(reframed, df, tt_value, ML, variables, direction, lat_lis
 
 def get_input_data(station, train_test, variables, ML, input_dir, resample, resample_method, batch,
                    scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold,
-                   logger, model_dir):
+                   logger, model_dir, feature_dir=None, sst_dir=SST_DIR):
     """Get the input data for a given station and preprocess it. This includes generating a training, test, and validation set. 
 
     Args:
         station (str): Name of station
         train_test (str): Whether the station is used for training or testing ("Train", "Test")
+        feature_dir (str, optional): Directory of the feature store with prepared station data, see feature_store. Defaults to None (no store).
+        sst_dir (str, optional): Directory of the <station>_sst.nc files that are joined when 'sst' is a desired variable. Defaults to SST_DIR.
 
     Returns:
         Station: Station object with input data
@@ -563,11 +749,23 @@ def get_input_data(station, train_test, variables, ML, input_dir, resample, resa
     print(f'\nGetting Input Data for {station}\n')
     df, lat_list, lon_list, direction, scaler, reframed, test_dates, i_test_dates = prepare_station(station, variables, ML, input_dir, resample, resample_method,
                                                                                                                 cluster_years=5, extreme_thr=0.02, sample=False, make_univariate=False,
-                                                                                                                scaler_type=scaler_type, year = year, scaler_op=True, n_ncells=n_ncells, mask_val=mask_val, logger=logger)
+                                                                                                                scaler_type=scaler_type, year = year, scaler_op=True, n_ncells=n_ncells, mask_val=mask_val, logger=logger,
+                                                                                                                feature_dir=feature_dir, sst_dir=sst_dir)
     # Turn batch size from daily to hourly
     if resample == 'hourly':                            
         batch = batch * 24
 
+    if ML in ['ANN', 'LSTM', 'TCN', 'TCN-LSTM']:
+        # Draw the training and validation timesteps as positions in the reframed data, leaving out the test year
+        # The batches are gathered from this single float32 matrix during training and the test set is taken from it as well,
+        # see station.BatchSequence and Station.reload_data
+        features = np.ascontiguousarray(reframed.values, dtype=np.float32)
+        isnan = np.isnan(features[:, -1])
+        isnan[i_test_dates] = True
+        draw, n_train = ensemble_indices(isnan, ML, batch, tt_value=tt_value, frac_ens=frac_ens)
+        return Station(station, train_test, None, None, None, None, None, None, scaler, df, None, 0, i_test_dates, None, model_dir, ML,
+                       features=features, train_index=draw[:n_train], val_index=draw[n_train:])
+    
     # split testing phase year    
     test_year = reframed.iloc[i_test_dates].copy()
 
@@ -593,19 +791,24 @@ def get_input_data(station, train_test, variables, ML, input_dir, resample, resa
     return Station(station, train_test, train_X, train_y, test_X, test_y, val_X, val_y, scaler, df, reframed, 0, i_test_dates, test_year, model_dir, ML)
 
 
-def get_coast_stations(coast):
+def get_coast_stations(coast, catalog=None):
     """Gets list of training and test stations for a given coast
 
     Args:
         coast (str): Name of coast
+        catalog (pd.DataFrame, optional): Station catalog (see station_catalog.build_catalog). If given, only stations with residual data in the catalog are returned. Defaults to None.
 
     Returns:
         list, list: list of training stations, list of testing stations
     """
-    # Load in stations df
-    station_data = pd.read_csv('Stations/Selected_Stations_w_Data.csv').dropna().reset_index(drop=True)
+    # Get stations df from the registry
+    station_data = station_registry()
     coast_stations = station_data[station_data['Coast'] == coast] 
     
+    if catalog is not None:
+        with_data = catalog.index[catalog['missing_frac'] < 1]
+        coast_stations = coast_stations[coast_stations['Station'].isin(with_data)]
+    
     # Get desired station lists
     train_stations = coast_stations['Station'][coast_stations['Train_test'] == 'Train'].tolist()
     test_stations = coast_stations['Station'][coast_stations['Train_test'] == 'Test'].tolist()
@@ -613,80 +816,95 @@ def get_coast_stations(coast):
     return train_stations, test_stations
 
 
-def get_all_station_data(coast, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir):
+def get_all_station_data(coast, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir, feature_dir=None, sst_dir=SST_DIR, catalog=None):
+        # The station catalog of input_dir is built (or updated) when it is not given, stations without residual data are skipped
+        if catalog is None:
+            catalog = station_catalog.build_catalog(input_dir)
+
         # Get input data for each station
         stations = {}
-        train_stations, test_stations = get_coast_stations(coast)
+        train_stations, test_stations = get_coast_stations(coast, catalog)
         rand.shuffle(train_stations) # Randomize order of training stations
         for station in train_stations + test_stations:# [:2]:
             # Get input data for the station
             # This includes the train, test, and validation data, as well as the scaler and transformed data for inverse transforming
             try:
                 train_test = 'Train' if station in train_stations else 'Test'
-                stations[station] = get_input_data(station, train_test, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir)
-            except:
-                print('Not enough data for station station: ', station)
+                stations[station] = get_input_data(station, train_test, variables, ML, input_dir, resample, resample_method, batch, scaler_type, year, n_ncells, mask_val, tt_value, frac_ens, NaN_threshold, logger, model_dir, feature_dir, sst_dir)
+            except Exception as e:
+                print('Not enough data for station station: ', station, repr(e))
                 
         return stations
 
-def normalize_coast_orientation(ds, direction, variables, n_ncells):
-    
+def point_values(da):
+    """Values of a variable that is not space dependent (residual or sst).
+
+    The variable may also be stored on the grid as (time, latitude, longitude), e.g. in the detrended files.
+    Then the first grid cell is used, like the first column of the pivoted frame before.
+
+    Args:
+        da (xr.DataArray): Variable with a time dimension and optionally latitude and longitude dimensions
+
+    Returns:
+        np.array: Values along time
+    """
+    grid_dims = [dim for dim in ['latitude', 'longitude'] if dim in da.dims]
+    if grid_dims:
+        da = da.sortby(grid_dims).isel({dim: 0 for dim in grid_dims})
+    if da.dims != ('time',):
+        raise ValueError(f'{da.name} must have dimensions (time,) or (time, latitude, longitude), not {da.dims}')
+    return da.values
+
+def coast_orientation_array(ds, direction, variables, n_ncells):
+    """Build the coast orientation normalized input features directly from the gridded dataset.
+
+    The box of n_ncells around the middle cell is selected with isel and rotated to "face" north with np.rot90,
+    so the relative positioning of each grid cell is consistent across all stations.
+    The features are written straight into a contiguous float32 (time, features) array without a long-format intermediate.
+    The columns are residual, sst (if it is a desired variable), and then the spatial variables for every grid cell of the rotated box.
+
+    Args:
+        ds (xr.Dataset): Station dataset with residual and the gridded variables
+        direction (str): Direction the coast is facing ('N', 'E', 'S' or 'W')
+        variables (list): Desired variables
+        n_ncells (int): Number of cells around the middle cell
+
+    Returns:
+        np.array, np.array, list, np.array, np.array: features (time, features), time, column names, latitudes and longitudes of the box
+    """
     # Identify desired lats and lons
     middle = int(len(ds.longitude)/2)
-    lon_list = ds.longitude.values[middle - n_ncells: middle + n_ncells + 1]
-    lat_list = ds.latitude.values[middle - n_ncells: middle + n_ncells + 1]
+    box = {'latitude': slice(middle - n_ncells, middle + n_ncells + 1),
+           'longitude': slice(middle - n_ncells, middle + n_ncells + 1)}
+    lon_list = ds.longitude.values[box['longitude']]
+    lat_list = ds.latitude.values[box['latitude']]
     
-    # Turn xarray into pandas dataframe and select desired variables
-    ds_df = ds.to_dataframe().get(['residual'] + variables).reset_index()
+    # residual and sst are not space dependent so they only get a single column
+    point_vars = ['residual'] + (['sst'] if 'sst' in variables else [])
+    spatial_vars = [var for var in variables if var not in point_vars]
     
-    # Pivot dataframe to get a unique column for each latitude longitude and variable
-    df = ds_df.pivot(index='time', columns = ['latitude', 'longitude'])
+    # Matrix of latitude longitude names of the spatial box, rotated in the same way as the data
+    k = {'N': 0, 'E': 1, 'S': 2, 'W': 3}.get(direction, 0)
+    lat_lon_matrix = np.rot90([[f'{lat}_{lon}' for lon in lon_list] for lat in lat_list], k=k, axes=(0,1))
+    columns = point_vars + [f'{var}_{lat_lon}' for lat_lon in lat_lon_matrix.ravel() for var in spatial_vars]
     
-    # Rename columns from multiindex to single index of the form: 'variable_latitude_longitude'
-    df.columns = ['_'.join(map(str, col_list)) for col_list in df.columns.values]
+    n_point = len(point_vars)
+    n_var = len(spatial_vars)
+    values = np.empty((len(ds.time), len(columns)), dtype=np.float32)
+    for i, var in enumerate(point_vars):
+        values[:, i] = point_values(ds[var])
+    for i, var in enumerate(spatial_vars):
+        # Select the box, rotate it to face north and write it in the (cell, variable) column ordering
+        var_box = ds[var].isel(box).transpose('time', 'latitude', 'longitude').values
+        values[:, n_point + i::n_var] = np.rot90(var_box, k=k, axes=(1,2)).reshape(len(ds.time), -1)
     
-    # We only want one column for residual and sst since they are not space dependent
-    # Thus we want to remove the redundant columns in the dataframe
-    def remove_excess_lat_lon_columns(df, var):
-        # Get all columns with the variable name
-        cols = df.columns[df.columns.str.startswith(var)] 
-        
-        # Set the variable column to the first column with the variable name
-        # So a unique 'residual' column is created and the redundant columns are removed
-        df[var] = df[cols[0]] 
-        df.drop(cols, axis=1, inplace=True)
-        
-        return df
+    return values, ds.time.values, columns, lat_list, lon_list
 
-    # Here we also establish the start of the new column ordering
+def normalize_coast_orientation(ds, direction, variables, n_ncells):
+    
     # The column ordering is the important aspect of the coastline orientation normalization
     # This is because the models do not inherently look for spatial relationships but they can learn them if their relative variable positioning is the same
-    new_col_order = ['residual']
-    df = remove_excess_lat_lon_columns(df, 'residual')
-    
-    # Only remove sst if it is a desired variable
-    if 'sst' in variables:
-        df = remove_excess_lat_lon_columns(df, 'sst')
-        new_col_order.append('sst') # Add sst to the new column ordering
-        
-        
-    # Make a matrix where each element in a latitutde longitude tuple 
-    # This matrix looks like a spatial box 
-    lat_lon_matrix = [[f'{lat}_{lon}' for lon in lon_list] for lat in lat_list] 
-    
-    # We rotate this spatial box to "face" north
-    if direction == 'E':
-        lat_lon_matrix = np.rot90(lat_lon_matrix, k=1, axes=(0,1))
-    elif direction == 'W':
-        lat_lon_matrix = np.rot90(lat_lon_matrix, k=3, axes=(0,1))
-    elif direction == 'S':
-        lat_lon_matrix = np.rot90(lat_lon_matrix, k=2, axes=(0,1))
-        
-    # Now that the spatial box is facing north, the relative positioning of each latitude and longitude is consistent across all stations
-    # Thus now we can reorder the columns in the dataframe to match the new consistent column ordering that adheres by the coastal orientation
-    for i in range(len(lat_lon_matrix)):
-        for j in range(len(lat_lon_matrix[i])):
-            new_col_order += df.columns[df.columns.str.endswith(lat_lon_matrix[i][j])].to_list()
-        
+    values, time, columns, lat_list, lon_list = coast_orientation_array(ds, direction, variables, n_ncells)
+    df = pd.DataFrame(values, index=pd.Index(time, name='time'), columns=columns, copy=False)
 
-    return df[new_col_order], lat_list, lon_list
\ No newline at end of file
+    return df, lat_list, lon_list
\ No newline at end of file
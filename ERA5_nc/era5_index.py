@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial index of stations on the ERA5 grid
+
+For every station the index holds the ERA5 latitude and longitude positions of the
+(2 * n_ncells + 1) x (2 * n_ncells + 1) box around the nearest grid cell. It is
+built once, stored as netCDF, and used to extract the boxes of all stations in one
+pass over ERA5 into per-station stores (see extract_stations and station_dataset).
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from gesla import load_header
+
+INDEX_FILE = 'ERA5_station_index.nc'
+STATION_DIR = 'ERA5_stations'
+
+
+def grid_positions(values, grid):
+    """Positions of the nearest cells of a regular (ascending or descending) grid"""
+    step = grid[1] - grid[0]
+    return np.rint((np.asarray(values) - grid[0]) / step).astype(int)
+
+
+def build_index(stations, latitude, longitude, n_ncells=2, lon_offset=0):
+    """
+    Args:
+        stations (pd.DataFrame): 'Station', 'Lat' and 'Lon' per station
+        latitude (np.array): ERA5 latitudes
+        longitude (np.array): ERA5 longitudes
+        n_ncells (int): number of cells around the centre cell
+        lon_offset (float): added to the station longitudes to get the longitude
+            labels of the file, e.g. 180 for the ERA-5_full files
+
+    Returns:
+        xr.Dataset: 'lat_index' (station, y) and 'lon_index' (station, x)
+    """
+    offset = np.arange(-n_ncells, n_ncells + 1)
+    n_lon = len(longitude)
+    global_lon = abs(longitude[1] - longitude[0]) * n_lon >= 359.99
+
+    i_lat = grid_positions(stations['Lat'].values, latitude)
+    lat_index = np.clip(i_lat[:, None] + offset, 0, len(latitude) - 1)
+
+    lon = stations['Lon'].values + lon_offset
+    if global_lon:
+        # station longitudes in the convention of the grid (e.g. 0-360)
+        lon = (lon - longitude[0]) % 360 + longitude[0]
+        lon_index = (grid_positions(lon, longitude)[:, None] + offset) % n_lon
+    else:
+        lon_index = np.clip(grid_positions(lon, longitude)[:, None] + offset, 0, n_lon - 1)
+
+    return xr.Dataset({'lat_index': (('station', 'y'), lat_index),
+                       'lon_index': (('station', 'x'), lon_index)},
+                      coords={'station': stations['Station'].values,
+                              'Lat': ('station', stations['Lat'].values),
+                              'Lon': ('station', stations['Lon'].values)},
+                      attrs={'n_ncells': n_ncells, 'lon_offset': lon_offset})
+
+
+def gesla_stations(gesla_dir='GESLA'):
+    """Station name and coordinates of all GESLA files"""
+    rows = []
+    for file in sorted(glob.glob(os.path.join(gesla_dir, '*'))):
+        meta = load_header(file)
+        rows.append([os.path.split(file)[1], meta.latitude, meta.longitude])
+    return pd.DataFrame(rows, columns=['Station', 'Lat', 'Lon'])
+
+
+def station_index(era5, n_ncells=2, lon_offset=0, index_file=INDEX_FILE, gesla_dir='GESLA'):
+    """
+    Load the station index, or build it for all GESLA stations on the grid of era5
+    and store it. The index is rebuilt when n_ncells or lon_offset differs from the
+    stored one.
+    """
+    if os.path.exists(index_file):
+        index = xr.load_dataset(index_file)
+        if index.attrs['n_ncells'] == n_ncells and index.attrs.get('lon_offset', 0) == lon_offset:
+            return index
+    index = build_index(gesla_stations(gesla_dir), era5.latitude.values,
+                        era5.longitude.values, n_ncells=n_ncells, lon_offset=lon_offset)
+    index.to_netcdf(index_file)
+    return index
+
+
+def extract_stations(era5, index, out_dir=STATION_DIR, time_chunk=24 * 7, flush_chunks=4):
+    """
+    Extract the boxes of all stations in one pass over era5
+
+    era5 is read once in blocks of time_chunk steps; the boxes of all stations are
+    gathered from each block with fancy indexing and written into preallocated
+    per-station arrays out_dir/<station>/<variable>.npy of shape (time, y, x).
+    The time axis is stored in out_dir/time.npy.
+
+    The boxes of flush_chunks blocks are buffered in memory and then written to the
+    station files one file at a time, so only one file is open at any moment.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lat_index = index['lat_index'].values
+    lon_index = index['lon_index'].values
+    stations = index['station'].values
+    variables = list(era5.data_vars)
+    n_time = len(era5.time)
+    box_shape = (n_time, lat_index.shape[1], lon_index.shape[1])
+
+    np.save(os.path.join(out_dir, 'time.npy'), era5.time.values)
+    paths = {}
+    for i, station in enumerate(stations):
+        station_dir = os.path.join(out_dir, str(station))
+        os.makedirs(station_dir, exist_ok=True)
+        np.save(os.path.join(station_dir, 'latitude.npy'), era5.latitude.values[lat_index[i]])
+        np.save(os.path.join(station_dir, 'longitude.npy'), era5.longitude.values[lon_index[i]])
+        for var in variables:
+            # preallocate the array on disk
+            paths[station, var] = os.path.join(station_dir, f'{var}.npy')
+            store = np.lib.format.open_memmap(paths[station, var], mode='w+', dtype=np.float32,
+                                              shape=box_shape)
+            del store
+
+    rows = lat_index[:, :, None]
+    cols = lon_index[:, None, :]
+    flush_steps = time_chunk * flush_chunks
+    for flush_start in range(0, n_time, flush_steps):
+        n_steps = min(flush_steps, n_time - flush_start)
+        buffer = {var: np.empty((n_steps, len(stations)) + box_shape[1:], dtype=np.float32)
+                  for var in variables}
+        for start in range(flush_start, flush_start + n_steps, time_chunk):
+            block = era5.isel(time=slice(start, min(start + time_chunk, flush_start + n_steps)))
+            for var in variables:
+                # (time, latitude, longitude) -> (time, station, y, x)
+                buffer[var][start - flush_start:start - flush_start + len(block.time)] = \
+                    block[var].values[:, rows, cols]
+
+        for var in variables:
+            for i, station in enumerate(stations):
+                store = np.lib.format.open_memmap(paths[station, var], mode='r+')
+                store[flush_start:flush_start + n_steps] = buffer[var][:, i]
+                store.flush()
+                del store
+
+
+def station_dataset(station, out_dir=STATION_DIR):
+    """Memory-map the extracted box of a station as an xr.Dataset"""
+    station_dir = os.path.join(out_dir, str(station))
+    coords = {'time': np.load(os.path.join(out_dir, 'time.npy')),
+              'latitude': np.load(os.path.join(station_dir, 'latitude.npy')),
+              'longitude': np.load(os.path.join(station_dir, 'longitude.npy'))}
+    variables = {}
+    for file in sorted(glob.glob(os.path.join(station_dir, '*.npy'))):
+        var = os.path.split(file)[1][:-4]
+        if var not in coords:
+            variables[var] = (('time', 'latitude', 'longitude'), np.load(file, mmap_mode='r'))
+    return xr.Dataset(variables, coords=coords)
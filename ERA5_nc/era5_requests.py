@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Planning and caching of ERA5 requests
+
+Overlapping (area, years, variables) requests are merged into a minimal set of
+downloads. Downloads are stored in a content-addressed cache named after a hash of
+the request, so a request that is already on disk is never sent again. Any object
+with a cdsapi.Client-like retrieve(name, request, target) method can serve the
+requests, e.g. LocalBackend for testing without the CDS. Afterwards every wanted
+request is linked (or extracted) from the downloads to its own target file.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import xarray as xr
+
+DATASET = 'reanalysis-era5-single-levels'
+CACHE_DIR = 'ERA5_cache'
+VARIABLES = ['10m_u_component_of_wind', '10m_v_component_of_wind', 'mean_sea_level_pressure']
+SHORT_NAMES = {'10m_u_component_of_wind': 'u10', '10m_v_component_of_wind': 'v10',
+               'mean_sea_level_pressure': 'msl'}
+MONTHS = [str(i).zfill(2) for i in range(1, 13)]
+DAYS = [str(i).zfill(2) for i in range(1, 32)]
+TIMES = [f'{str(i).zfill(2)}:00' for i in range(24)]
+
+
+def era5_request(variables, years, months=MONTHS, area=None):
+    """Hourly ERA5 single level request in netcdf format"""
+    request = {'product_type': 'reanalysis',
+               'format': 'netcdf',
+               'variable': list(variables),
+               'year': [str(year) for year in years],
+               'month': list(months),
+               'day': DAYS,
+               'time': TIMES}
+    if area is not None:
+        request['area'] = [float(i) for i in area]
+    return request
+
+
+def request_key(request, name=DATASET):
+    return hashlib.sha1(json.dumps([name, request], sort_keys=True).encode()).hexdigest()
+
+
+def cache_path(request, name=DATASET, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'{request_key(request, name)}.nc')
+
+
+def seed_cache(request, source, name=DATASET, cache_dir=CACHE_DIR):
+    """
+    Add an existing download of request (e.g. an earlier per-site file) to the cache
+
+    Returns:
+        bool: whether the request is in the cache
+    """
+    cache_file = cache_path(request, name, cache_dir)
+    if not os.path.exists(cache_file) and os.path.exists(source):
+        os.makedirs(cache_dir, exist_ok=True)
+        link(source, cache_file)
+    return os.path.exists(cache_file)
+
+
+def plan_requests(wanted, max_years=4):
+    """
+    Merge wanted requests into the minimal set of downloads
+
+    Requests for the same area are combined into the union of their years, months and
+    variables, and split into downloads of at most max_years years.
+
+    Args:
+        wanted (list): (station, area, years, months, variables) per wanted request
+
+    Returns:
+        list: (request, stations) per download, with the stations it serves
+    """
+    groups = {}
+    for station, area, years, months, variables in wanted:
+        group = groups.setdefault(tuple(float(i) for i in area),
+                                  {'years': set(), 'months': set(), 'variables': set(),
+                                   'stations': set()})
+        group['years'].update(int(year) for year in years)
+        group['months'].update(months)
+        group['variables'].update(variables)
+        group['stations'].add(station)
+
+    plan = []
+    for area, group in groups.items():
+        years = sorted(group['years'])
+        for i in range(0, len(years), max_years):
+            request = era5_request(sorted(group['variables']), years[i:i + max_years],
+                                   sorted(group['months']), area)
+            plan.append((request, sorted(group['stations'])))
+    return plan
+
+
+def link(source, target):
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def fetch(request, backend, target=None, name=DATASET, cache_dir=CACHE_DIR):
+    """
+    Return the cached file of a request, downloading it with backend if it is missing
+
+    Args:
+        request (dict): CDS request
+        backend: object with a retrieve(name, request, target) method, e.g. cdsapi.Client()
+        target (str): optional path where the cached file is linked (or copied) to
+
+    Returns:
+        str: path of the file in the cache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = cache_path(request, name, cache_dir)
+    if not os.path.exists(cache_file):
+        tmp_file = cache_file + '.part'
+        backend.retrieve(name, request, tmp_file)
+        os.replace(tmp_file, cache_file)
+    if target is not None:
+        link(cache_file, target)
+    return cache_file
+
+
+def link_targets(wanted, plan, target, name=DATASET, cache_dir=CACHE_DIR):
+    """
+    Create the target file of every wanted request from the planned downloads
+
+    A wanted request that is exactly one download is linked to it. Otherwise its
+    years, months and variables are extracted from the downloads that cover it and
+    written to its target, so a target holds exactly what was requested and can be
+    added to the cache under the key of the wanted request (see seed_cache).
+
+    Args:
+        wanted (list): (station, area, years, months, variables) per wanted request,
+            as passed to plan_requests
+        plan (list): (request, stations) per download, see plan_requests
+        target (function): station -> path of its target file
+
+    Returns:
+        list: stations whose downloads are not all in the cache, so have no target
+    """
+    missing = []
+    for station, area, years, months, variables in wanted:
+        wanted_key = request_key(era5_request(variables, years, months, area), name)
+        years = {int(year) for year in years}
+        requests = [request for request, stations in plan
+                    if station in stations and years & {int(year) for year in request['year']}]
+        files = [cache_path(request, name, cache_dir) for request in requests]
+        if not files or not all(os.path.exists(file) for file in files):
+            missing.append(station)
+        elif len(requests) == 1 and request_key(requests[0], name) == wanted_key:
+            link(files[0], target(station))
+        else:
+            with xr.open_mfdataset(files, combine='by_coords') as downloads:
+                keep = [SHORT_NAMES.get(var, var) for var in variables]
+                downloads = downloads[[var for var in downloads.data_vars if var in keep]]
+                downloads = downloads.sel(time=downloads.time.dt.year.isin(sorted(years))
+                                          & downloads.time.dt.month.isin([int(month) for month in months]))
+                downloads.to_netcdf(target(station))
+    return missing
+
+
+class LocalBackend():
+    """
+    Stand-in for the CDS that serves files from a local directory
+
+    A request is served from <source_dir>/<request key>.nc; every served request is
+    kept in self.requests.
+    """
+    def __init__(self, source_dir):
+        self.source_dir = source_dir
+        self.requests = []
+
+    def retrieve(self, name, request, target):
+        self.requests.append((name, request))
+        source = os.path.join(self.source_dir, f'{request_key(request, name)}.nc')
+        if not os.path.exists(source):
+            raise FileNotFoundError(f'No local file for request {request_key(request, name)}')
+        shutil.copyfile(source, target)
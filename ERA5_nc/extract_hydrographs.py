@@ -10,7 +10,7 @@ import glob
 import logging
 import logging.handlers
 import matplotlib.dates as mdates
-from multiprocessing import Process, Manager, Pool
+from multiprocessing import Pool, current_process
 import numpy as np
 import pandas as pd
 import os
@@ -19,6 +19,12 @@ import time
 #import utide
 import xarray as xr
 
+from era5_index import STATION_DIR, extract_stations, station_dataset, station_index
+from era5_requests import (VARIABLES, era5_request, fetch, link_targets, plan_requests,
+                           request_key, seed_cache)
+from gesla import load_gesla
+from scheduler import run_tasks
+
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -71,77 +77,134 @@ def set_logger(verbose=True):
     return logger, ch
 
 
-def GESLA_data():
-    mismatch = []
-    for file in glob.glob('GESLA/*'):
-        print(file)
-        start = time.time()
-        df = pd.read_table(file, header=None, encoding="ISO-8859-1")
-        data = pd.DataFrame(df[0].iloc[32:].str.split().tolist(), columns=['date', 'time',
-                            'Sea level', 'QC flag', 'EA flag'])
-
-        df = df.iloc[:32]
-        meta = {}
-        meta['Site name'] = df[df[0].str.contains("SITE NAME")].values.flatten()[0].split()[3:][0]
-        meta['Country'] = df[df[0].str.contains("COUNTRY")].values.flatten()[0].split()[2:][0]
-        meta['Latitude'] = df[df[0].str.contains("LATITUDE")].values.flatten()[0].split()[2:][0]
-        meta['Longitude'] = df[df[0].str.contains("LONGITUDE")].values.flatten()[0].split()[2:][0]
-        meta['CS'] = df[df[0].str.contains("COORDINATE SYSTEM")].values.flatten()[0].split()[3:][0]
-        meta['Tz'] = df[df[0].str.contains("TIME ZONE HOURS")].values.flatten()[0].split()[4:][0]
-        meta['St'] = df[df[0].str.contains("START DATE/TIME")].values.flatten()[0].split()[3:4][0]
-        meta['End'] = df[df[0].str.contains("END DATE/TIME")].values.flatten()[0].split()[3:4][0]
-
-        if data['date'].iloc[0] != meta['St']:
-            mismatch.append(file)
-
-        data['Timestamp'] = pd.to_datetime(data['date'] + ' ' + data['time'])
-        data = data.set_index('Timestamp')
-        data = data.drop(['date', 'time'], axis=1)
-        data = data.astype(float)
-
-        flagged = data['QC flag'] > 2.0
-        data['Sea level'][flagged] = np.nan
-        data['anomaly'] = data['Sea level'] - data['Sea level'].mean()
-        # data['anomaly'] = data['anomaly'].interpolate()
-        t = mdates.date2num(data.index.to_pydatetime())
-        print('{} points were flagged 3-5'.format(flagged.sum()))
-
-        coef = utide.solve(t, data['anomaly'].values, lat=float(meta['Latitude']), method='ols',
-                           conf_int='linear', constit='auto', trend=True, phase='Greenwich',
-                           nodal=True)
-        tide = utide.reconstruct(t, coef)
-        data['tide'] = tide.h
-        data['residue'] = data.anomaly - tide.h
-        data = data.resample('h').mean()
-        data.to_csv('Utide' + os.sep + f'Utide_{os.path.split(file)[1]}.csv')
-        print(f'Calculation took {time.time() - start} seconds')
-
-    df = pd.DataFrame(mismatch[:], columns=['Mismatch starting date'])
+def utide_file(file):
+    return os.path.join('Utide', f'Utide_{os.path.split(file)[1]}.nc')
+
+
+def utide_fit(t, h, lat):
+    coef = utide.solve(t, h, lat=lat, method='ols',
+                       conf_int='linear', constit='auto', trend=True, phase='Greenwich',
+                       nodal=True)
+    return utide.reconstruct(t, coef).h
+
+
+def utide_windows(t, window_years, overlap_years):
+    """
+    Overlapping multi-year windows over the date numbers t as (start, end) positions
+    """
+    if not 0 < overlap_years < window_years:
+        raise ValueError('overlap_years has to be positive and smaller than window_years')
+    window = window_years * 365.25
+    step = (window_years - overlap_years) * 365.25
+    windows = []
+    begin = t[0]
+    while True:
+        windows.append((np.searchsorted(t, begin), np.searchsorted(t, begin + window)))
+        if begin + window > t[-1]:
+            break
+        begin += step
+    return windows
+
+
+def utide_windowed(t, h, lat, window_years=10, overlap_years=2, workers=1):
+    """
+    Fit the tide on overlapping windows of window_years and blend the reconstructions
+    with linear weights over the overlap, so the memory of one fit is bounded by the
+    window length. Windows without any valid value are skipped.
+    """
+    windows = [(start, end) for start, end in utide_windows(t, window_years, overlap_years)
+               if np.isfinite(h[start:end]).any()]
+    args = [(t[start:end], h[start:end], lat) for start, end in windows]
+    if workers > 1 and not current_process().daemon:
+        with Pool(workers) as p:
+            tides = p.starmap(utide_fit, args)
+    else:
+        tides = [utide_fit(*arg) for arg in args]
+
+    tide = np.zeros(len(t))
+    weight = np.zeros(len(t))
+    for k, ((start, end), tide_k) in enumerate(zip(windows, tides)):
+        w = np.ones(end - start)
+        tk = t[start:end]
+        if k > 0 and windows[k - 1][1] > start:
+            ramp_end = t[windows[k - 1][1] - 1]
+            w = np.where(tk < ramp_end, (tk - tk[0]) / max(ramp_end - tk[0], 1e-9), w)
+        if k < len(windows) - 1 and windows[k + 1][0] < end:
+            ramp_start = t[windows[k + 1][0]]
+            w = np.minimum(w, np.where(tk > ramp_start, (tk[-1] - tk) / max(tk[-1] - ramp_start, 1e-9), 1))
+        tide[start:end] += w * tide_k
+        weight[start:end] += w
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weight > 0, tide / weight, np.nan)
+
+
+def utide_station(file, window_years=None, overlap_years=2, window_workers=1):
+    """
+    Tidal harmonic analysis of one GESLA station, written to Utide/Utide_<station>.nc
+    Records longer than window_years are fitted in overlapping windows (utide_windowed)
+    Returns whether the first record mismatches the start date in the header
+    """
+    data, meta = load_gesla(file)
+    mismatch = data.index[0].date() != meta.start.date()
+
+    data = data.astype(float)
+
+    flagged = data['QC flag'] > 2.0
+    data.loc[flagged, 'Sea level'] = np.nan
+    data['anomaly'] = data['Sea level'] - data['Sea level'].mean()
+    # data['anomaly'] = data['anomaly'].interpolate()
+    t = mdates.date2num(data.index.to_pydatetime())
+    print('{} points were flagged 3-5'.format(flagged.sum()))
+
+    if window_years and t[-1] - t[0] > window_years * 365.25:
+        tide = utide_windowed(t, data['anomaly'].values, meta.latitude, window_years=window_years,
+                              overlap_years=overlap_years, workers=window_workers)
+    else:
+        tide = utide_fit(t, data['anomaly'].values, meta.latitude)
+    data['tide'] = tide
+    data['residue'] = data.anomaly - tide
+    data = data.resample('h').mean()
+    data.to_xarray().to_netcdf(utide_file(file))
+    return mismatch
+
+
+def GESLA_data(workers=os.cpu_count(), status_file=os.path.join('Utide', 'status.csv'),
+               retry_failed=False, window_years=None, overlap_years=2, window_workers=1,
+               timeout=None):
+    """
+    Tidal harmonic analysis of all GESLA stations on the work queue (see scheduler).
+    Every finished station is recorded in the status table, so an interrupted run
+    resumes with the stations that are not done yet. With window_years, long
+    records are fitted in overlapping windows (see utide_windowed) on window_workers
+    processes per station, and the largest files are started first so they do not
+    end up as the tail of the run.
+    """
+    starttime = time.time()
+    os.makedirs('Utide', exist_ok=True)
+    files = sorted(glob.glob('GESLA/*'), key=os.path.getsize, reverse=True)
+    tasks = {os.path.split(file)[1]: (file, window_years, overlap_years, window_workers)
+             for file in files}
+    status = run_tasks(utide_station, tasks, status_file, workers=workers, timeout=timeout,
+                       retries=0, retry_failed=retry_failed,
+                       is_done=lambda station: os.path.exists(utide_file(station)))
+
+    mismatch = status.index[status['Result'].astype(str) == 'True'].tolist()
+    df = pd.DataFrame(mismatch, columns=['Mismatch starting date'])
     datelog = time.ctime().replace(':', '-').replace(' ', '_')
     df.to_csv(f'Mismatch_starting_date_{datelog}.csv')
 
+    print('That took {} hours'.format((time.time() - starttime) / 3600))
+
 
 def ERA5_prep():
     ds_fids = []
     for file in glob.glob('GESLA/*'):
         start = time.time()
         print(file)
-        df = pd.read_table(file, header=None, encoding="ISO-8859-1")
-        data = pd.DataFrame(df[0].iloc[32:].str.split().tolist(), columns=['date', 'time',
-                            'Sea level', 'QC flag', 'EA flag'])
-
-        df = df.iloc[:32]
-        meta = {}
-        meta['Latitude'] = df[df[0].str.contains("LATITUDE")].values.flatten()[0].split()[2:][0]
-        meta['Longitude'] = df[df[0].str.contains("LONGITUDE")].values.flatten()[0].split()[2:][0]
-
-        data['Timestamp'] = pd.to_datetime(data['date'] + ' ' + data['time'])
-        data = data.set_index('Timestamp')
-        data = data.drop(['date', 'time'], axis=1)
-        data = data.astype(float)
-
-        pr_lon = PartialRound(float(meta['Longitude']), 0.25)
-        pr_lat = PartialRound(float(meta['Latitude']), 0.25)
+        data, meta = load_gesla(file)
+
+        pr_lon = PartialRound(meta.longitude, 0.25)
+        pr_lat = PartialRound(meta.latitude, 0.25)
         area = [pr_lat, pr_lon, pr_lat, pr_lon]
 
         years = data.index.year.unique().values.tolist()
@@ -164,100 +227,24 @@ def ERA5_prep():
     ds.to_netcdf('ERA5_requests.nc')
 
 
-def ERA5_requests_per_site(fid, failed):
-    station = ds.isel(fid=fid)['Station'].values.tolist()
-    years = ds.isel(fid=fid)['years'].values.tolist()
-    months = ds.isel(fid=fid)['months'].values.tolist()
-    area = ds.isel(fid=fid)['area'].values.tolist()
-    era5_file = 'ERA5' + os.sep + f'ERA-5_{station}.nc'
-    try:
-        c.retrieve(
-            'reanalysis-era5-single-levels',
-            {
-                'product_type': 'reanalysis',
-                'format': 'netcdf',
-                'variable': ['10m_u_component_of_wind', '10m_v_component_of_wind',
-                             'mean_sea_level_pressure'],
-                'year': years,
-                'month': months,
-                'day': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12',
-                        '13', '14', '15',  '16', '17', '18', '19', '20', '21', '22', '23', '24',
-                        '25', '26', '27', '28', '29', '30', '31'],
-                'time': ['00:00', '01:00', '02:00', '03:00', '04:00', '05:00', '06:00', '07:00',
-                         '08:00', '09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00',
-                         '16:00', '17:00', '18:00', '19:00', '20:00', '21:00', '22:00', '23:00'],
-                'area': area,
-            },
-            era5_file)
-        print(f'Finished fid {fid}: {station}')
-    except:
-        print(f'Failed fid {fid}: {station}')
-        failed.append(station)
-
-
-def ERA5_requests_per_site_pool(fid):
-    station = ds.isel(fid=fid)['Station'].values.tolist()
-    years = ds.isel(fid=fid)['years'].values.tolist()
-    months = ds.isel(fid=fid)['months'].values.tolist()
-    area = ds.isel(fid=fid)['area'].values.tolist()
-    era5_file = 'ERA5' + os.sep + f'ERA-5_{station}.nc'
-    try:
-        c.retrieve(
-            'reanalysis-era5-single-levels',
-            {
-                'product_type': 'reanalysis',
-                'format': 'netcdf',
-                'variable': ['10m_u_component_of_wind', '10m_v_component_of_wind',
-                             'mean_sea_level_pressure'],
-                'year': years,
-                'month': months,
-                'day': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12',
-                        '13', '14', '15',  '16', '17', '18', '19', '20', '21', '22', '23', '24',
-                        '25', '26', '27', '28', '29', '30', '31'],
-                'time': ['00:00', '01:00', '02:00', '03:00', '04:00', '05:00', '06:00', '07:00',
-                         '08:00', '09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00',
-                         '16:00', '17:00', '18:00', '19:00', '20:00', '21:00', '22:00', '23:00'],
-                'area': area,
-            },
-            era5_file)
-        print(f'Finished fid {fid}: {station}')
-        failed = False
-    except:
-        print(f'Failed fid {fid}: {station}')
-        failed = True
-    return [fid, failed]
-
-
-def ERA5_requests_full(years, var):
+def era5_target(station):
+    return 'ERA5' + os.sep + f'ERA-5_{station}.nc'
+
+
+def ERA5_requests_planned(request):
+    return fetch(request, c)
+
+
+def ERA5_requests_full(years, var, cache_dir='U:\\ERA5_cache'):
+    # the cache is on the same volume as the target, so the file is linked instead of copied
     era5_file = 'U:\\ERA5_full' + os.sep + f'ERA-5_full_{years[0]}-{years[-1]}_{var}.nc'
-    try:
-        c.retrieve(
-            'reanalysis-era5-single-levels',
-            {
-                'product_type': 'reanalysis',
-                'format': 'netcdf',
-                'variable': [var],
-                'year': years,
-                'month': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'],
-                'day': ['01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12',
-                        '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', '23', '24',
-                        '25', '26', '27', '28', '29', '30', '31'],
-                'time': ['00:00', '01:00', '02:00', '03:00', '04:00', '05:00', '06:00', '07:00',
-                         '08:00', '09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00',
-                         '16:00', '17:00', '18:00', '19:00', '20:00', '21:00', '22:00', '23:00'],
-            },
-            era5_file)
-        print(f'Finished years: {years}')
-        failed = False
-    except:
-        print(f'Failed years: {years}')
-        failed = True
-    return [years, failed]
+    fetch(era5_request([var], years), c, target=era5_file, cache_dir=cache_dir)
+    print(f'Finished years: {years}')
 
 
 def Merge_data(file):
     ds = xr.open_dataset('ERA5' + os.sep + f'ERA-5_{os.path.split(file)[1]}.nc')
-    gesla = pd.read_csv(f'Utide/Utide_{os.path.split(file)[1]}.csv')
+    gesla = xr.open_dataset(utide_file(file)).to_dataframe()
     era_data = pd.to_datetime(ds['time'].values).to_frame(name='msl')
     era_data.truncate(before=gesla.index.min(), after=gesla.index.max())
     era_data['msl'] = ds['msl'].values.flatten()
@@ -270,48 +257,62 @@ def PartialRound(value, resolution):
     return round(value / resolution) * resolution
 
 
-def ERA5_per_site_parallel():
+def ERA5_site_requests():
+    """(station, area, years, months, variables) of every per-site request in ERA5_requests.nc"""
+    return [(ds.isel(fid=fid)['Station'].values.tolist(),
+             ds.isel(fid=fid)['area'].values.tolist(),
+             ds.isel(fid=fid)['years'].values.tolist(),
+             ds.isel(fid=fid)['months'].values.tolist(),
+             VARIABLES) for fid in range(len(ds['fid']))]
+
+
+def ERA5_requests_plan(wanted=None, max_years=4):
+    """
+    Merge the per-site requests (by default all in ERA5_requests.nc) into the minimal set
+    of downloads and store which stations each download serves in ERA5_requests_plan.csv
+    """
+    wanted = ERA5_site_requests() if wanted is None else wanted
+    plan = plan_requests(wanted, max_years=max_years)
+    df = pd.DataFrame([[request_key(request), request['area'], request['year'][0],
+                        request['year'][-1], ' '.join(stations)] for request, stations in plan],
+                      columns=['Key', 'Area', 'Start', 'End', 'Stations'])
+    df.to_csv('ERA5_requests_plan.csv', index=False)
+    print(f'{len(wanted)} site requests merged into {len(plan)} downloads')
+    return plan
+
+
+def ERA5_per_site_parallel(workers=10, timeout=6 * 3600, retries=3,
+                            status_file='ERA5_requests_status.csv'):
+    """
+    Download the planned ERA5 requests (see ERA5_requests_plan) on the work queue and
+    link or extract them to the ERA5/ERA-5_<station>.nc file of every site
+    Downloads that are already in the cache are not requested again, and existing
+    per-site files are added to the cache so those sites are not planned again
+    """
     starttime = time.time()
-    num = 10
-    ds_blocks = []
-    for block in range(29, int(round(len(ds['fid']) / num) + 1)):
-        fid_list = range(block * num, min(block * num + num, len(ds['fid']) + 1))
-        print('--------------------------------------')
-        print(f'FID BLOCK: {fid_list[0]}-{fid_list[-1]}')
-        print('--------------------------------------')
-        with Manager() as manager:
-            failed = manager.list([])
-            processes = []
-            for i in fid_list:
-                p = Process(target=ERA5_requests_per_site, args=(i, failed))
-                processes.append(p)
-                p.start()
-
-            for process in processes:
-                process.join()
-
-            ds_blocks.extend(failed[:])
-
-    df = pd.DataFrame(ds_blocks, columns=['Failed station requests'])
+    os.makedirs('ERA5', exist_ok=True)
+    todo = []
+    for station, area, years, months, variables in ERA5_site_requests():
+        request = era5_request(variables, years, months, area)
+        if seed_cache(request, era5_target(station)):
+            fetch(request, c, target=era5_target(station))
+        else:
+            todo.append((station, area, years, months, variables))
+
+    plan = ERA5_requests_plan(todo)
+    tasks = {request_key(request): (request,) for request, stations in plan}
+    run_tasks(ERA5_requests_planned, tasks, status_file, workers=workers,
+              timeout=timeout, retries=retries)
+
+    failed = link_targets(todo, plan, era5_target)
+    df = pd.DataFrame(failed, columns=['Failed station requests'])
     datelog = time.ctime().replace(':', '-').replace(' ', '_')
     df.to_csv(f'Failed_station_requests_{datelog}.csv')
 
     print('That took {} hours'.format((time.time() - starttime) / 3600))
 
 
-def ERA5_per_site_parallel_pool():
-    with Pool(5) as p:
-        reslist = [p.apply_async(ERA5_requests_per_site_pool,
-                                 (r,)) for r in range(1506, len(ds['fid']))]
-        out = []
-        for result in reslist:
-            out.append(result.get())
-        df = pd.DataFrame()
-        df['FID'] = [i[0] for i in out]
-        df['Failed'] = [i[1] for i in out]
-
-
-def ERA5_full_parallel():
+def ERA5_full_parallel(workers=5, timeout=24 * 3600, retries=3):
     starttime = time.time()
     year_inst = [['1979', '1980', '1981', '1982'],
                  ['1983', '1984', '1985', '1986', '1987', '1988'],
@@ -334,93 +335,70 @@ def ERA5_full_parallel():
     print('----------------------------------------------------')
     print(f'Start full requests: {year_list[0]}-{year_list[-1]}')
     print('----------------------------------------------------')
-    with Pool(5) as p:
-        reslist = [p.apply_async(ERA5_requests_full, (r, j,)) for r, j in zip(year_list, var_list)]
-        out = []
-        for result in reslist:
-            out.append(result.get())
-        print(out, '\n')
-        df = pd.DataFrame()
-        # df['FID'] = [i[0] for i in out]
-        # df['Failed'] = [i[1] for i in out]
+    tasks = {f'{years[0]}-{years[-1]}_{var}': (years, var) for years, var in zip(year_list, var_list)}
+    status = run_tasks(ERA5_requests_full, tasks, 'ERA5_full_status.csv', workers=workers,
+                       timeout=timeout, retries=retries)
+    print(status, '\n')
 
     print('That took {} hours'.format((time.time() - starttime) / 3600))
 
 
-def ERA5_requests_update():
-    # for duplicate area and years
-    num = 4
-    df = pd.DataFrame()
-    df['lon'] = [i[0] for i in ds.area.values]
-    df['lat'] = [i[1] for i in ds.area.values]
-    df['start'] = [int(i[0]) for i in ds.years.values]
-    df['end'] = [int(i[-1]) for i in ds.years.values]
-    start_list = df.groupby(['lat', 'lon']).agg({'start': min})
-    end_list = df.groupby(['lat', 'lon']).agg({'end': max})
-    area_list = []
-    year_list = []
-    for i in start_list.index:
-        area = [i[1], i[0], i[1], i[0]]
-        for j in range(start_list.loc[i]['start'], end_list.loc[i]['end'], num):
-            area_list.append(area)
-            year_tolist = []
-            for k in range(j, end_list.loc[i]['end'] - j):
-                year_tolist.append(str(k))
-            year_list.append(year_tolist)
-    print(len(area_list))
-
-
-def merge_era5_utide():
-    years_file = ['1979-1982', '1983-1988', '1989-1994', '1995-2000', '2001-2006', '2007-2012',
-                  '2013-2018']
-    years_range = ['1979-1980-1981-1982', '1983-1984-1985-1986-1987-1988',
-                   '1989-1990-1991-1992-1993-1994', '1995-1996-1997-1998-1999-2000',
-                   '2001-2002-2003-2004-2005-2006', '2007-2008-2009-2010-2011-2012',
-                   '2013-2014-2015-2016-2017-2018']
-    var_short_list = ['msl', 'u10', 'v10']
-    var_long_list = ['mean_sea_level_pressure', '10m_u_component_of_wind',
-                     '10m_v_component_of_wind']
-    
-    # for u_file in glob.glob('Utide/*'):
-    for u_file in ['Utide_abidjan_vridi-230a-ivory_coast-uhslc.csv']:
+ERA5_VARIABLES = {'msl': 'mean_sea_level_pressure',
+                  'u10': '10m_u_component_of_wind',
+                  'v10': '10m_v_component_of_wind'}
+
+# The longitude labels of the ERA-5_full files are the station longitudes + 180
+ERA5_LON_OFFSET = 180
+
+
+def open_era5(era5_dir='ERA5_nc', chunks={'time': 24 * 365}):
+    """
+    Open all yearly ERA5 files of all variables as one lazily chunked dataset
+    Nothing is read from disk until a subset is loaded or written
+    """
+    variables = []
+    for var_long in ERA5_VARIABLES.values():
+        files = sorted(glob.glob(os.path.join(era5_dir, f'ERA-5_full_*_{var_long}.nc')))
+        variables.append(xr.open_mfdataset(files, combine='by_coords', chunks=chunks))
+    return xr.merge(variables)
+
+
+def ERA5_extract_all_stations(n_ncells=2, era5_dir='ERA5_nc', time_chunk=24 * 7, station_dir=STATION_DIR):
+    """
+    Extract the ERA5 boxes of all GESLA stations reading each ERA5 file only once
+    """
+    starttime = time.time()
+    era5 = open_era5(era5_dir)
+    index = station_index(era5, n_ncells=n_ncells, lon_offset=ERA5_LON_OFFSET)
+    logger.info(f'Extracting {len(index.station)} stations from {len(era5.time)} time steps')
+    extract_stations(era5, index, out_dir=station_dir, time_chunk=time_chunk)
+    logger.info('That took {} hours'.format((time.time() - starttime) / 3600))
+
+
+def merge_era5_utide(n_ncells=2, era5_dir='ERA5_nc', station_dir=STATION_DIR):
+    """
+    Merge the Utide output of each station with the ERA5 grid box around it
+    The boxes are read from the per-station stores of ERA5_extract_all_stations (which is
+    run first if they do not exist yet), cut to the station period, and written to
+    Merged/Merged_<station>.nc
+    """
+    os.makedirs('Merged', exist_ok=True)
+    if not os.path.exists(os.path.join(station_dir, 'time.npy')):
+        ERA5_extract_all_stations(n_ncells=n_ncells, era5_dir=era5_dir, station_dir=station_dir)
+
+    # for u_file in glob.glob('Utide/*.nc'):
+    for u_file in ['Utide_abidjan_vridi-230a-ivory_coast-uhslc.nc']:
+        u_file = os.path.split(u_file)[1]
         starttime = time.time()
-        logger.info(f'Start merging data for {u_file[6:-4]}')
-        df = pd.read_csv(os.path.join('Utide', u_file), parse_dates=True, index_col='Timestamp')
-        yearmin = df.index.year.min()
-        yearmax = df.index.year.max()
-        indexmin = np.where([f'{yearmin}' in i for i in years_range])[0][0]
-        indexmax = np.where([f'{yearmax}' in i for i in years_range])[0][0]
-        logger.info(f'  -- Year range total: {yearmin}-{yearmax}')
-    
-        gesla_file = os.path.join('GESLA', u_file[6:-4])
-        gesla = pd.read_table(gesla_file, header=None, encoding="ISO-8859-1").head(32)
-        meta = {}
-        meta['Lat'] = gesla[gesla[0].str.contains("LATITUDE")].values.flatten()[0].split()[2:][0]
-        meta['Lon'] = gesla[gesla[0].str.contains("LONGITUDE")].values.flatten()[0].split()[2:][0]
-        pr_lon = PartialRound(float(meta['Lon']), 0.25) + 180
-        pr_lat = PartialRound(float(meta['Lat']), 0.25)
-        
-        for var_short in var_short_list:
-            df[var_short] = np.nan
-        
-        for i in range(indexmin, indexmax + 1):
-            years = years_file[i]
-            logger.info(f'  -- Year range iteration: {years}')
-            for var_short, var_long in zip(var_short_list, var_long_list):
-                logger.info(f'  -- ERA var: {var_short}')
-                era5_file = 'ERA5_nc' + os.sep + f'ERA-5_full_{years}_{var_long}.nc'
-                era5 = xr.open_dataset(era5_file)
-                df_years = df.truncate(before=pd.Timestamp(f'{years[:4]}-01-01'),
-                                       after=pd.Timestamp(f'{years[5:]}-12-31 23:00:00')).index
-                starttime1 = time.time()
-                var = era5[var_short].sel(latitude=pr_lat, longitude=pr_lon, 
-                                          time=slice(df_years.min(), df_years.max()))
-                condition =(df.index >= df_years.min()) & (df.index <= df_years.max())
-                df[var_short][condition] = var.values
-                
-                logger.info('  -- loading and writer took {} minutes'
-                            .format((time.time() - starttime1) / 60))
-        df.to_csv(os.path.join('Merged', f'Merged_{u_file[6:-4]}.csv'))
+        logger.info(f'Start merging data for {u_file[6:-3]}')
+        utide_ds = xr.open_dataset(os.path.join('Utide', u_file)).rename({'Timestamp': 'time'})
+        logger.info(f'  -- Period: {utide_ds.time.values[0]} - {utide_ds.time.values[-1]}')
+
+        box = station_dataset(u_file[6:-3], station_dir).reindex(time=utide_ds.time)
+
+        merged = xr.merge([utide_ds, box])
+        merged.to_netcdf(os.path.join('Merged', f'Merged_{u_file[6:-3]}.nc'))
+        utide_ds.close()
         logger.info('  -- Station finished in {} minutes'.format((time.time() - starttime) / 60))
         logger.info('#################################################')
 
@@ -431,4 +409,4 @@ ds = xr.open_dataset('ERA5_requests.nc')
 if __name__ == '__main__':
     merge_era5_utide()
     # ERA5_full_parallel()
-    # ERA5_per_site_parallel_pool()
+    # ERA5_per_site_parallel()
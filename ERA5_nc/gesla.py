@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Reading GESLA tide gauge files
+
+The 32-line header is parsed once into a GESLAMeta record and the data block is
+read with the pandas C parser straight into typed columns. Parsed stations are
+cached as one .npy file per column, so later runs memory-map them instead of
+parsing the text again.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+HEADER_LINES = 32
+ENCODING = 'ISO-8859-1'
+DATA_COLUMNS = ['date', 'time', 'Sea level', 'QC flag', 'EA flag']
+DATA_DTYPES = {'date': str, 'time': str, 'Sea level': np.float32,
+               'QC flag': np.int8, 'EA flag': np.int8}
+
+# header label -> GESLAMeta field
+HEADER_FIELDS = {'SITE NAME': 'site_name',
+                 'COUNTRY': 'country',
+                 'LATITUDE': 'latitude',
+                 'LONGITUDE': 'longitude',
+                 'COORDINATE SYSTEM': 'coordinate_system',
+                 'TIME ZONE HOURS': 'time_zone',
+                 'START DATE/TIME': 'start',
+                 'END DATE/TIME': 'end'}
+
+CACHE_DIR = 'GESLA_cache'
+CACHE_COLUMNS = ['Sea level', 'QC flag', 'EA flag']
+
+
+class GESLAMeta(NamedTuple):
+    site_name: str
+    country: str
+    latitude: float
+    longitude: float
+    coordinate_system: str
+    time_zone: float
+    start: pd.Timestamp
+    end: pd.Timestamp
+
+
+def parse_header(lines):
+    """Parse the GESLA header lines into a GESLAMeta record
+
+    Args:
+        lines (list): header lines of a GESLA file (including the leading '#')
+
+    Returns:
+        GESLAMeta: typed station metadata
+    """
+    fields = {}
+    for line in lines:
+        line = line.lstrip('#').strip()
+        for label, field in HEADER_FIELDS.items():
+            if field not in fields and line.startswith(label):
+                fields[field] = line[len(label):].split()
+                break
+
+    missing = [field for field in HEADER_FIELDS.values() if field not in fields]
+    if missing:
+        raise ValueError(f'GESLA header is missing: {missing}')
+
+    return GESLAMeta(site_name=fields['site_name'][0],
+                     country=fields['country'][0],
+                     latitude=float(fields['latitude'][0]),
+                     longitude=float(fields['longitude'][0]),
+                     coordinate_system=fields['coordinate_system'][0],
+                     time_zone=float(fields['time_zone'][0]),
+                     start=pd.Timestamp(' '.join(fields['start'][:2])),
+                     end=pd.Timestamp(' '.join(fields['end'][:2])))
+
+
+def read_header(file):
+    """Read only the metadata of a GESLA file
+
+    Args:
+        file (str): path to GESLA file
+
+    Returns:
+        GESLAMeta: typed station metadata
+    """
+    with open(file, encoding=ENCODING) as f:
+        lines = [f.readline() for _ in range(HEADER_LINES)]
+    return parse_header(lines)
+
+
+def read_gesla(file):
+    """Read a GESLA file into a time indexed dataframe and its metadata
+
+    Args:
+        file (str): path to GESLA file
+
+    Returns:
+        pd.DataFrame, GESLAMeta: 'Sea level' (float32), 'QC flag' and 'EA flag' (int8)
+            indexed by 'Timestamp', and the station metadata
+    """
+    with open(file, encoding=ENCODING) as f:
+        lines = [f.readline() for _ in range(HEADER_LINES)]
+        meta = parse_header(lines)
+        data = pd.read_csv(f, sep=r'\s+', header=None, names=DATA_COLUMNS,
+                           dtype=DATA_DTYPES, engine='c')
+
+    timestamp = pd.to_datetime(data['date'] + ' ' + data['time'], format='%Y/%m/%d %H:%M:%S')
+    data = data.drop(['date', 'time'], axis=1)
+    data.index = pd.DatetimeIndex(timestamp, name='Timestamp')
+    return data, meta
+
+
+def file_signature(file, checksum=True):
+    """Size, modification time and (optionally) SHA-1 of a source file"""
+    stat = os.stat(file)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if checksum:
+        sha1 = hashlib.sha1()
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        signature['sha1'] = sha1.hexdigest()
+    return signature
+
+
+def cache_path(file, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, os.path.split(file)[1])
+
+
+def read_cache_meta(file, cache_dir=CACHE_DIR):
+    """Return the cached entry description of a GESLA file or None when it is stale
+
+    The entry is valid when size and modification time of the source are unchanged.
+    When only the modification time differs the SHA-1 decides, and a matching entry
+    is refreshed with the new modification time.
+    """
+    meta_file = os.path.join(cache_path(file, cache_dir), 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        entry = json.load(f)
+
+    source = entry['source']
+    signature = file_signature(file, checksum=False)
+    if signature['size'] != source['size']:
+        return None
+    if signature['mtime_ns'] != source['mtime_ns']:
+        signature = file_signature(file)
+        if signature['sha1'] != source['sha1']:
+            return None
+        entry['source'] = signature
+        with open(meta_file, 'w') as f:
+            json.dump(entry, f)
+    return entry
+
+
+def meta_from_dict(meta):
+    meta = dict(meta)
+    meta['start'] = pd.Timestamp(meta['start'])
+    meta['end'] = pd.Timestamp(meta['end'])
+    return GESLAMeta(**meta)
+
+
+def write_cache(file, data, meta, cache_dir=CACHE_DIR):
+    """Write a parsed GESLA station to the columnar cache
+
+    Every column (and the timestamps as int64 nanoseconds) is stored as a separate
+    .npy file next to a meta.json with the station metadata and source signature.
+    The entry is written to a temporary directory first and then moved in place.
+    """
+    path = cache_path(file, cache_dir)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, 'Timestamp.npy'), data.index.values.astype('datetime64[ns]').view('int64'))
+    for col in CACHE_COLUMNS:
+        np.save(os.path.join(tmp_path, f'{col}.npy'), data[col].values)
+
+    meta_dict = meta._asdict()
+    meta_dict['start'] = meta.start.isoformat()
+    meta_dict['end'] = meta.end.isoformat()
+    entry = {'source': file_signature(file), 'meta': meta_dict, 'length': len(data)}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(entry, f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def read_cache(file, cache_dir=CACHE_DIR):
+    """Memory-map the cached columns of a GESLA station
+
+    Returns:
+        dict, GESLAMeta: read-only arrays per column (including 'Timestamp'), and
+            the station metadata. None, None when there is no valid entry.
+    """
+    entry = read_cache_meta(file, cache_dir)
+    if entry is None:
+        return None, None
+    path = cache_path(file, cache_dir)
+    columns = {col: np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r')
+               for col in ['Timestamp'] + CACHE_COLUMNS}
+    columns['Timestamp'] = columns['Timestamp'].view('datetime64[ns]')
+    return columns, meta_from_dict(entry['meta'])
+
+
+def load_gesla(file, cache_dir=CACHE_DIR):
+    """Read a GESLA file through the cache, parsing the text only when needed
+
+    Args:
+        file (str): path to GESLA file
+        cache_dir (str): directory of the columnar cache
+
+    Returns:
+        pd.DataFrame, GESLAMeta: same output as read_gesla
+    """
+    columns, meta = read_cache(file, cache_dir)
+    if columns is None:
+        data, meta = read_gesla(file)
+        write_cache(file, data, meta, cache_dir)
+        return data, meta
+
+    index = pd.DatetimeIndex(columns.pop('Timestamp'), name='Timestamp')
+    return pd.DataFrame(columns, index=index), meta
+
+
+def load_header(file, cache_dir=CACHE_DIR):
+    """Read the metadata of a GESLA file from the cache, or from its header"""
+    entry = read_cache_meta(file, cache_dir)
+    if entry is None:
+        return read_header(file)
+    return meta_from_dict(entry['meta'])
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Work queue for the extraction and request drivers
+
+Tasks are taken from a queue by a fixed number of worker slots. A task runs in its
+own process, so it can be stopped when it exceeds the timeout, and sends its outcome
+back over its own pipe, so stopping it can not block the other tasks. Failed tasks are
+retried with an exponential backoff and every outcome is written to a status table,
+which lets an interrupted run resume with the tasks that are not done yet.
+"""
+
+import logging
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import os
+import time
+
+import pandas as pd
+
+STATUS_COLUMNS = ['Task', 'Status', 'Attempts', 'Seconds', 'Result', 'Error']
+
+logger = logging.getLogger('Coastal_hydrographs')
+
+
+def read_status(status_file):
+    if os.path.exists(status_file):
+        return pd.read_csv(status_file, index_col='Task', dtype={'Task': str},
+                           keep_default_na=False)
+    return pd.DataFrame(columns=STATUS_COLUMNS[1:]).rename_axis(STATUS_COLUMNS[0])
+
+
+def run_task(func, key, attempt, args, conn):
+    start = time.time()
+    try:
+        result = func(*args)
+        conn.send((key, attempt, 'done', time.time() - start, result, ''))
+    except Exception as e:
+        conn.send((key, attempt, 'error', time.time() - start, None, repr(e)))
+    conn.close()
+
+
+def run_tasks(func, tasks, status_file, workers=5, timeout=None, retries=3, backoff=60,
+              retry_failed=False, is_done=None, poll=1):
+    """
+    Run func(*args) for every task on a bounded number of worker processes
+
+    Args:
+        func (function): task function, failures are signalled by raising
+        tasks (dict): task name -> tuple of arguments
+        status_file (str): csv with the status of every task, read to resume
+        workers (int): number of tasks running at the same time
+        timeout (float): seconds after which a running task is terminated
+        retries (int): number of retries after a failed or timed out attempt
+        backoff (float): seconds before the first retry, doubled for every next one
+        retry_failed (bool): also run tasks that failed in an earlier run
+        is_done (function): task name -> whether the output of a task that is done
+            still exists, otherwise the task is run again
+        poll (float): seconds to wait for results before checking timeouts
+
+    Returns:
+        pd.DataFrame: status table
+    """
+    status = read_status(status_file)
+    tasks = {str(key): args for key, args in tasks.items()}
+    skip = ['done'] if retry_failed else ['done', 'failed']
+    pending = [(0, key) for key in tasks
+               if key not in status.index or status.loc[key, 'Status'] not in skip
+               or (status.loc[key, 'Status'] == 'done' and is_done is not None and not is_done(key))]
+    logger.info(f'{len(pending)} of {len(tasks)} tasks to run on {workers} workers')
+
+    attempts = {key: 0 for _, key in pending}
+    running = {}
+
+    def finish(key, outcome, seconds, result, error):
+        if outcome == 'done':
+            status.loc[key] = ['done', attempts[key], seconds, result, '']
+            logger.info(f'Finished {key} in {seconds:.1f} seconds')
+        elif attempts[key] <= retries:
+            delay = backoff * 2 ** (attempts[key] - 1)
+            pending.append((time.time() + delay, key))
+            status.loc[key] = ['retrying', attempts[key], seconds, '', error]
+            logger.info(f'Failed {key} ({error}), retry in {delay} seconds')
+        else:
+            status.loc[key] = ['failed', attempts[key], seconds, '', error]
+            logger.info(f'Failed {key} ({error}), giving up after {attempts[key]} attempts')
+        status.to_csv(status_file)
+
+    while pending or running:
+        # start tasks that are ready while there are free workers
+        pending.sort()
+        while len(running) < workers and pending and pending[0][0] <= time.time():
+            _, key = pending.pop(0)
+            attempts[key] += 1
+            conn, child_conn = mp.Pipe(duplex=False)
+            p = mp.Process(target=run_task, args=(func, key, attempts[key], tasks[key], child_conn))
+            p.start()
+            child_conn.close()
+            running[key] = (p, time.time(), conn, attempts[key])
+
+        # collect the outcomes of finished tasks
+        conns = {conn: key for key, (_, _, conn, _) in running.items()}
+        for conn in wait(list(conns), timeout=poll if running else 0):
+            key = conns[conn]
+            p, started, _, attempt = running.pop(key)
+            try:
+                outcome_key, outcome_attempt, outcome, seconds, result, error = conn.recv()
+            except EOFError:
+                # the worker ended without sending an outcome
+                p.join()
+                conn.close()
+                finish(key, 'error', time.time() - started, None, f'exit code {p.exitcode}')
+                continue
+            conn.close()
+            p.join()
+            if (outcome_key, outcome_attempt) != (key, attempt):
+                # outcome of an attempt that is no longer running
+                continue
+            finish(key, outcome, seconds, result, error)
+
+        # terminate tasks that take too long
+        for key, (p, started, conn, _) in list(running.items()):
+            if timeout and time.time() - started > timeout:
+                p.terminate()
+                p.join()
+                conn.close()
+                running.pop(key)
+                finish(key, 'error', time.time() - started, None, f'timeout after {timeout} seconds')
+
+        if not running and pending:
+            # wait for the next retry
+            time.sleep(min(poll, max(0, min(pending)[0] - time.time())))
+
+    return status
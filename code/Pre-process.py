@@ -13,6 +13,7 @@ from sklearn.preprocessing import MinMaxScaler, PowerTransformer
 from sklearn.metrics import mean_squared_error
 import numpy as np
 import pandas as pd
+import xarray as xr
 from keras.layers import Dense, LSTM, Dropout, GRU, Bidirectional
 from keras.optimizers import SGD
 
@@ -22,10 +23,11 @@ from keras.optimizers import SGD
 
 # LOAD DATA
 fn_data = r'E:\github\Coastal-hydrographs\MachineLearning\DATA'
-file = 'Merged_Utide_vung_tau_a-383a-vietnam-uhslc.csv'
-date_parser = lambda x: pd.datetime.strptime(x, "%Y-%m-%d %H:%M:%S")
-Xs = pd.read_csv(os.path.join(fn_data, file), parse_dates = True, date_parser= date_parser, index_col = 0, dtype={'msl':np.float32,'u10':np.float32,'v10':np.float32})
-Xs = Xs[Xs.columns[-3:]].copy()
+file = 'Merged_vung_tau_a-383a-vietnam-uhslc.nc'
+# The merged file holds the ERA5 box around the station, keep the centre cell
+ds = xr.open_dataset(os.path.join(fn_data, file))
+ds = ds.isel(latitude=len(ds.latitude) // 2, longitude=len(ds.longitude) // 2)
+Xs = ds[['msl', 'u10', 'v10']].to_dataframe()[['msl', 'u10', 'v10']].astype(np.float32)
 Xs['gradient'] = Xs.loc[:,'msl'].diff(1)
 Xs['wind'] = Xs['u10']**2 + Xs['v10']**2
 